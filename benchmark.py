@@ -0,0 +1,560 @@
+"""Banc de charge reproductible du protocole socket de serveur.py
+
+Démarre un FileShareServer sur localhost (processus séparé, répertoire
+temporaire) puis le fait travailler par N clients simulés:
+
+- login: tempête de connexions + LOGIN simultanés
+- chat: diffusion de messages à tous les clients connectés
+- list: LIST complet et paginé sur un grand répertoire
+- transfer: UPLOAD puis DOWNLOAD concurrents de gros fichiers
+
+Pour chaque scénario: débit, latences p50/p99/max et mémoire (RSS) maximale
+du serveur. Les résultats peuvent être ajoutés à un fichier JSON Lines
+(--output) et comparés à une exécution précédente (--baseline).
+
+Exemple: python benchmark.py --engine asyncio --clients 200 --output bench.jsonl
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+
+def parse_size(text):
+    """Taille avec suffixe facultatif K, M ou G (puissances de 1024)"""
+    text = text.strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_summary(latencies):
+    """p50, p99, max et moyenne en millisecondes"""
+    if not latencies:
+        return {'count': 0}
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+    }
+
+
+class BenchClient:
+    """Client du protocole en tramage par longueur (FRAMING LEN)"""
+
+    def __init__(self, port, timeout=60):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = bytearray()
+        # La réponse à la poignée de main part encore dans l'ancien mode
+        self.sock.sendall(b'FRAMING LEN\n')
+        expected = b'SUCCES FRAMING LEN'
+        reply = self.recv_exact(len(expected))
+        if reply != expected:
+            raise RuntimeError(f"Négociation du tramage refusée: {reply!r}")
+        self.events = []
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def recv_exact(self, size):
+        while len(self.buffer) < size:
+            data = self.sock.recv(max(65536, size - len(self.buffer)))
+            if not data:
+                raise ConnectionError("Connexion fermée par le serveur")
+            self.buffer += data
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def recv_frame(self):
+        size = int.from_bytes(self.recv_exact(4), 'big')
+        return self.recv_exact(size).decode('utf-8')
+
+    def send_frame(self, text):
+        payload = text.encode('utf-8')
+        self.sock.sendall(len(payload).to_bytes(4, 'big') + payload)
+
+    def command(self, text):
+        """Envoie une commande et retourne sa réponse SUCCES/ERREUR (le reste va dans events)"""
+        self.send_frame(text)
+        return self.response()
+
+    def response(self):
+        while True:
+            frame = self.recv_frame()
+            if frame.startswith(('SUCCES', 'ERREUR')):
+                return frame
+            self.events.append(frame)
+
+    def expect(self, text):
+        reply = self.command(text)
+        if not reply.startswith('SUCCES'):
+            raise RuntimeError(f"{text.split(' ')[0]}: {reply}")
+        return reply
+
+    def upload(self, filename, size, block):
+        """UPLOAD en flux de size octets pris dans un bloc répété"""
+        self.send_frame(f"UPLOAD {filename} {size}")
+        view = memoryview(block)
+        remaining = size
+        while remaining:
+            part = view[:min(len(view), remaining)]
+            self.sock.sendall(part)
+            remaining -= len(part)
+        reply = self.response()
+        if not reply.startswith('SUCCES'):
+            raise RuntimeError(f"UPLOAD: {reply}")
+
+    def download(self, filename):
+        """DOWNLOAD complet; retourne le nombre d'octets reçus"""
+        reply = self.command(f"DOWNLOAD {filename}")
+        if not reply.startswith('SUCCES'):
+            raise RuntimeError(f"DOWNLOAD: {reply}")
+        remaining = int(reply.split()[1])
+        total = remaining
+        taken = min(remaining, len(self.buffer))
+        del self.buffer[:taken]
+        remaining -= taken
+        while remaining:
+            data = self.sock.recv(min(remaining, 1024 * 1024))
+            if not data:
+                raise ConnectionError("Connexion fermée pendant le téléchargement")
+            remaining -= len(data)
+        return total
+
+
+class ServerProcess:
+    """serveur.py lancé dans un processus à part, dans un répertoire temporaire"""
+
+    def __init__(self, engine, workdir, extra_env=None):
+        self.engine = engine
+        self.workdir = workdir
+        self.port = self.free_port()
+        self.extra_env = extra_env or {}
+        self.process = None
+        self.peak_rss = 0
+        self.sampling = False
+
+    @staticmethod
+    def free_port():
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            return probe.getsockname()[1]
+
+    def start(self, timeout=30):
+        env = dict(os.environ, ENGINE=self.engine, **self.extra_env)
+        env['PYTHONPATH'] = os.path.dirname(os.path.abspath(__file__)) + os.pathsep + env.get('PYTHONPATH', '')
+        env.pop('PORT', None)
+        # Tous les clients du banc viennent de 127.0.0.1: pas de limites par adresse,
+        # ni d'admission progressive qui mesurerait le rythme imposé plutôt que le moteur
+        for name in ('MAX_CONNECTIONS_PER_IP', 'COMMAND_RATE', 'AUTH_RATE', 'ADMISSION_WARMUP'):
+            env.setdefault(name, '0')
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', str(self.port)],
+            cwd=self.workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("Le serveur s'est arrêté au démarrage")
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("Le serveur ne répond pas")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def rss(self):
+        """Mémoire résidente courante du serveur en octets (Linux), ou None"""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+
+    def sample_rss(self, interval=0.1):
+        """Relève le RSS maximal tant que sampling est vrai (thread dédié)"""
+        self.peak_rss = self.rss() or 0
+        while self.sampling:
+            self.peak_rss = max(self.peak_rss, self.rss() or 0)
+            time.sleep(interval)
+
+    def measure(self, scenario, *args):
+        """Exécute un scénario et ajoute le RSS maximal du serveur à son résultat"""
+        self.sampling = True
+        sampler = threading.Thread(target=self.sample_rss, daemon=True)
+        sampler.start()
+        try:
+            result = scenario(self, *args)
+        finally:
+            self.sampling = False
+            sampler.join()
+        result['server_rss_peak_mb'] = round(self.peak_rss / 1024 ** 2, 1) if self.peak_rss else None
+        return result
+
+
+def run_parallel(count, target):
+    """Lance target(i) dans count threads démarrés ensemble; retourne les erreurs"""
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def worker(index):
+        try:
+            barrier.wait()
+            target(index)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def register_users(port, count, prefix):
+    """Crée les comptes des clients simulés (hors mesure)"""
+    def register(index):
+        client = BenchClient(port)
+        try:
+            reply = client.command(f"REGISTER {prefix}{index} motdepasse")
+            if not reply.startswith('SUCCES') and 'existant' not in reply:
+                raise RuntimeError(reply)
+        finally:
+            client.close()
+    errors = run_parallel(count, register)
+    if errors:
+        raise RuntimeError(f"Création des comptes: {errors[0]}")
+
+
+def logged_in_clients(port, count, prefix):
+    clients = [None] * count
+
+    def login(index):
+        client = BenchClient(port)
+        client.expect(f"LOGIN {prefix}{index} motdepasse")
+        clients[index] = client
+    errors = run_parallel(count, login)
+    if errors:
+        raise RuntimeError(f"Connexion des clients: {errors[0]}")
+    return clients
+
+
+def scenario_login(server, options):
+    """Tempête de reconnexions: connexion + LOGIN simultanés de tous les clients"""
+    count = options.clients
+    register_users(server.port, count, 'login')
+    latencies = []
+    lock = threading.Lock()
+
+    def login(index):
+        started = time.perf_counter()
+        client = BenchClient(server.port)
+        try:
+            client.expect(f"LOGIN login{index} motdepasse")
+        finally:
+            client.close()
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    errors = run_parallel(count, login)
+    elapsed = time.perf_counter() - started
+    return {'clients': count, 'elapsed_s': round(elapsed, 3), 'errors': len(errors),
+            'throughput_ops_s': round(len(latencies) / elapsed, 1), 'latency': latency_summary(latencies)}
+
+
+def scenario_chat(server, options):
+    """Un émetteur envoie des messages, tous les clients connectés les reçoivent"""
+    count = options.clients
+    messages = options.messages
+    register_users(server.port, count, 'chat')
+    clients = logged_in_clients(server.port, count, 'chat')
+    sent_at = {}
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+    expected = messages * (count - 1)
+
+    def receive(client):
+        received = 0
+        try:
+            while received < messages:
+                frame = client.recv_frame()
+                # CHAT user [HH:MM:SS]: m<n>
+                if frame.startswith('CHAT ') and ': m' in frame:
+                    seq = int(frame.rsplit(': m', 1)[1])
+                    now = time.perf_counter()
+                    with lock:
+                        latencies.append(now - sent_at[seq])
+                        if len(latencies) == expected:
+                            done.set()
+                    received += 1
+        except (OSError, ConnectionError, ValueError, KeyError):
+            pass
+
+    sender, receivers = clients[0], clients[1:]
+    for client in receivers:
+        threading.Thread(target=receive, args=(client,), daemon=True).start()
+    started = time.perf_counter()
+    for seq in range(messages):
+        with lock:
+            sent_at[seq] = time.perf_counter()
+        sender.expect(f"CHAT m{seq}")
+    done.wait(options.timeout)
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        client.close()
+    return {'clients': count, 'messages': messages, 'deliveries': len(latencies), 'expected': expected,
+            'elapsed_s': round(elapsed, 3), 'throughput_ops_s': round(len(latencies) / elapsed, 1),
+            'latency': latency_summary(latencies)}
+
+
+def scenario_list(server, options):
+    """LIST complet et paginé sur un répertoire de options.files fichiers"""
+    count = min(options.clients, 32)
+    register_users(server.port, count, 'list')
+    clients = logged_in_clients(server.port, count, 'list')
+    latencies = {'full': [], 'page': []}
+    lock = threading.Lock()
+    per_client = max(1, options.list_requests // count)
+
+    def run(index):
+        client = clients[index]
+        for request in range(per_client):
+            kind = 'full' if request % 2 == 0 else 'page'
+            command = 'LIST' if kind == 'full' else 'LIST sort=mtime order=desc limit=100'
+            started = time.perf_counter()
+            client.expect(command)
+            with lock:
+                latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    errors = run_parallel(count, run)
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        client.close()
+    total = len(latencies['full']) + len(latencies['page'])
+    return {'clients': count, 'files': options.files, 'requests': total, 'errors': len(errors),
+            'elapsed_s': round(elapsed, 3), 'throughput_ops_s': round(total / elapsed, 1),
+            'latency': latency_summary(latencies['full'] + latencies['page']),
+            'latency_full': latency_summary(latencies['full']),
+            'latency_page': latency_summary(latencies['page'])}
+
+
+def scenario_transfer(server, options):
+    """UPLOAD puis DOWNLOAD simultanés de options.transfer_size octets par client"""
+    count = options.transfer_clients
+    size = options.transfer_size
+    register_users(server.port, count, 'transfer')
+    clients = logged_in_clients(server.port, count, 'transfer')
+    block = random.Random(0).randbytes(1024 * 1024)
+    results = {}
+    for phase in ('upload', 'download'):
+        latencies = []
+        lock = threading.Lock()
+
+        def run(index):
+            started = time.perf_counter()
+            if phase == 'upload':
+                clients[index].upload(f"bench-{index}.bin", size, block)
+            elif clients[index].download(f"bench-{index}.bin") != size:
+                raise RuntimeError("Taille téléchargée inattendue")
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        errors = run_parallel(count, run)
+        elapsed = time.perf_counter() - started
+        results[phase] = {'elapsed_s': round(elapsed, 3), 'errors': len(errors),
+                          'throughput_mb_s': round(len(latencies) * size / elapsed / 1024 ** 2, 1),
+                          'latency': latency_summary(latencies)}
+    for client in clients:
+        client.close()
+    return {'clients': count, 'size_bytes': size, **results}
+
+
+SCENARIOS = {
+    'login': scenario_login,
+    'chat': scenario_chat,
+    'list': scenario_list,
+    'transfer': scenario_transfer,
+}
+
+
+def populate_files(workdir, count):
+    """Grand répertoire partagé pour le scénario list (créé avant le démarrage)"""
+    files_dir = os.path.join(workdir, 'shared_files')
+    os.makedirs(files_dir, exist_ok=True)
+    for index in range(count):
+        with open(os.path.join(files_dir, f"fichier-{index:07d}.dat"), 'wb') as f:
+            f.write(b'x' * (index % 4096))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_fields(fields, indent):
+    for key, value in fields.items():
+        if isinstance(value, dict) and any(isinstance(item, dict) for item in value.values()):
+            print(f"{indent}{key}:")
+            print_fields(value, indent + '  ')
+        elif isinstance(value, dict):
+            print(f"{indent}{key}: " + ", ".join(f"{k}={v}" for k, v in value.items()))
+        else:
+            print(f"{indent}{key}: {value}")
+
+
+def print_result(name, result, baseline=None):
+    print(f"[{name}]")
+    print_fields(result, '  ')
+    if not baseline:
+        return
+    # Comparaison des débits et du p99, globalement et par phase (upload/download)
+    sections = [('', result, baseline)] + [(phase, result[phase], baseline[phase])
+                                          for phase in ('upload', 'download')
+                                          if isinstance(result.get(phase), dict) and isinstance(baseline.get(phase), dict)]
+    for phase, current, previous in sections:
+        label = f"{phase} " if phase else ''
+        for key in ('throughput_ops_s', 'throughput_mb_s'):
+            if current.get(key) and previous.get(key):
+                print(f"  vs référence {label}{key}: {(current[key] / previous[key] - 1) * 100:+.1f}%")
+        now_p99 = current.get('latency', {}).get('p99_ms')
+        before_p99 = previous.get('latency', {}).get('p99_ms')
+        if now_p99 and before_p99:
+            print(f"  vs référence {label}p99: {(now_p99 / before_p99 - 1) * 100:+.1f}%")
+
+
+def load_baseline(path, engine):
+    """Dernière exécution enregistrée avec le même moteur, ou None"""
+    last = None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('engine') == engine:
+                    last = record
+    except OSError:
+        return None
+    return last
+
+
+def serve(port):
+    """Point d'entrée du processus serveur (--serve): le banc tourne à toute heure"""
+    import serveur
+    serveur.FileShareServer.is_within_time_window = lambda self: True
+    serveur.server = serveur.FileShareServer(host='127.0.0.1', port=port)
+    serveur.start_file_server()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de charge du serveur de fichiers")
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default=os.environ.get('ENGINE', 'threads'))
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help="Scénarios séparés par des virgules (défaut: tous)")
+    parser.add_argument('--clients', type=int, default=50, help="Clients simulés (login, chat, list)")
+    parser.add_argument('--messages', type=int, default=200, help="Messages diffusés (chat)")
+    parser.add_argument('--files', type=int, default=10000, help="Fichiers dans le répertoire (list)")
+    parser.add_argument('--list-requests', type=int, default=400, help="Requêtes LIST au total")
+    parser.add_argument('--transfer-clients', type=int, default=4, help="Transferts simultanés")
+    parser.add_argument('--transfer-size', type=parse_size, default=parse_size('64M'),
+                        help="Taille de chaque fichier transféré (suffixes K, M, G)")
+    parser.add_argument('--timeout', type=float, default=60, help="Attente max de fin d'un scénario")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Ajoute le résultat (une ligne JSON) à ce fichier")
+    parser.add_argument('--baseline', help="Compare à la dernière exécution de ce fichier JSON Lines")
+    parser.add_argument('--json', action='store_true', help="Affiche le résultat complet en JSON")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.serve:
+        serve(options.serve)
+        return
+
+    random.seed(options.seed)
+    names = [name.strip() for name in options.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Scénario inconnu: {', '.join(unknown)}")
+
+    baseline = load_baseline(options.baseline, options.engine) if options.baseline else None
+    report = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'engine': options.engine,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parameters': {key: value for key, value in vars(options).items()
+                       if key not in ('output', 'baseline', 'json', 'serve')},
+        'results': {},
+    }
+
+    for name in names:
+        # Un serveur neuf par scénario: les mesures ne dépendent pas de l'ordre
+        workdir = tempfile.mkdtemp(prefix='bench-')
+        server = ServerProcess(options.engine, workdir)
+        try:
+            if name == 'list':
+                populate_files(workdir, options.files)
+            server.start()
+            result = server.measure(SCENARIOS[name], options)
+        except Exception as e:
+            result = {'error': f"{type(e).__name__}: {e}"}
+        finally:
+            server.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+        report['results'][name] = result
+        print_result(name, result, (baseline or {}).get('results', {}).get(name))
+
+    if options.output:
+        with open(options.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(report) + '\n')
+    if options.json:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,36 @@
 
 import os
 import socket
+import asyncio
 import threading
 import hashlib
+import hmac
 import json
+import zlib
+import lzma
+import bz2
+import base64
+import sqlite3
+import bisect
+import select
+import collections
+import itertools
+import tempfile
 import time
+import uuid
+import signal
+import sys
+import traceback
+import string
+import re
+import gzip
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate, parsedate_to_datetime
 import urllib.parse
+import mimetypes
+import struct
 
 class FileShareServer:
     def __init__(self, host='0.0.0.0', port=10000):
@@ -15,539 +38,4086 @@ class FileShareServer:
         self.port = int(os.environ.get('PORT', port))
         self.clients = {}
         self.accounts_file = 'accounts.json'
+        # Mode multi-processus: numéro de ce worker (None si processus unique), voir start_workers
+        self.worker_id = int(os.environ['WORKER_ID']) if 'WORKER_ID' in os.environ else None
+        self.bus_path = os.environ.get('BUS_SOCKET', 'workers.sock')  # Bus local entre workers
+        # Les workers partagent les comptes: seul sqlite est lu et écrit par plusieurs processus
+        self.account_store = os.environ.get('ACCOUNT_STORE', 'journal' if self.worker_id is None else 'sqlite')
+        self.accounts_db = 'accounts.db'
+        self.password_kdf = os.environ.get('PASSWORD_KDF', 'scrypt')  # 'scrypt' ou 'pbkdf2'
+        self.scrypt_n = int(os.environ.get('SCRYPT_N', 2 ** 14))
+        self.scrypt_r = 8
+        self.scrypt_p = 1
+        self.pbkdf2_iterations = int(os.environ.get('PBKDF2_ITERATIONS', 600000))
+        # Les calculs de mots de passe passent par un pool borné pour ne pas occuper tous les cœurs
+        self.kdf_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('KDF_WORKERS', max(1, (os.cpu_count() or 2) // 2))),
+                                           thread_name_prefix='kdf')
+        self.kdf_slots = threading.BoundedSemaphore(int(os.environ.get('KDF_QUEUE', 256)))  # Calculs en attente max
+        self.kdf_timeout = 10  # Attente max d'une place dans le pool (secondes)
+        self.credential_cache = CredentialCache(int(os.environ.get('CREDENTIAL_CACHE_TTL', 300)))
+        self.sessions_file = 'sessions.json'
+        self.session_ttl = int(os.environ.get('SESSION_TTL', 7 * 24 * 3600))  # Expiration glissante d'un jeton
+        self.max_sessions_per_user = int(os.environ.get('MAX_SESSIONS_PER_USER', 10))
         self.files_dir = 'shared_files'
-        self.chat_history = []
+        self.chat_log_file = 'messages.log'  # Journal append-only du chat
+        self.legacy_chat_file = 'messages.json'  # Ancien historique, importé au premier démarrage
+        self.chat_history_size = int(os.environ.get('CHAT_HISTORY_SIZE', 1000))  # Messages gardés en mémoire
+        self.chat_replay_depth = int(os.environ.get('CHAT_REPLAY', 10))  # Messages renvoyés au LOGIN
+        self.max_history_page = 500  # Messages max par réponse HISTORY
         self.start_hour = 7  # 7h
         self.end_hour = 22   # 22h
         self.timezone_offset = 2  # UTC+2 (Heure d'été France)
+        self.engine = os.environ.get('ENGINE', 'threads')  # 'threads' ou 'asyncio'
+        self.backlog = int(os.environ.get('BACKLOG', 1024))  # File d'attente de listen()
+        self.recv_buffer_size = int(os.environ.get('RECV_BUFFER', 65536))  # Tampon par connexion
+        self.max_frame_size = int(os.environ.get('MAX_FRAME', 1024 * 1024))  # Taille max d'une commande tramée
+        self.max_upload_size = int(os.environ.get('MAX_UPLOAD', 4 * 1024 ** 3))  # Taille max d'un fichier
+        self.upload_buffer_size = int(os.environ.get('UPLOAD_BUFFER', 256 * 1024))  # Tampon de réception d'un UPLOAD
+        self.chat_queue_size = int(os.environ.get('CHAT_QUEUE', 256))  # Messages en attente par client
+        self.broadcaster = Broadcaster(os.environ.get('SLOW_CLIENT_POLICY', 'disconnect'))  # ou 'drop'
+        self.chat_stream = ChatStream(self.broadcaster)  # Abonnés web (SSE) du chat
+        self.sse_keepalive = 15  # Secondes entre deux commentaires de maintien d'un flux SSE
+        self.uploads_dir = 'shared_files.parts'  # Transferts par blocs en cours
+        self.chunk_size = int(os.environ.get('CHUNK_SIZE', 8 * 1024 * 1024))  # Taille de bloc par défaut
+        self.max_chunk_size = 64 * 1024 * 1024
+        self.chunked_upload_ttl = 24 * 3600  # Durée de vie d'un transfert par blocs abandonné
+        self.storage_mode = os.environ.get('STORAGE', 'flat')  # 'flat' ou 'cas' (dédupliqué)
+        self.cas_dir = 'shared_files.cas'
+        self.cas_chunk_size = int(os.environ.get('CAS_CHUNK_SIZE', 4 * 1024 * 1024))
+        self.catalog_file = 'files.json'
+        self.compressed_dir = 'shared_files.z'  # Copies compressées servies aux DOWNLOAD comp=
+        self.max_list_page = 1000  # Entrées max par réponse LIST paginée
+        self.web_timeout = int(os.environ.get('WEB_TIMEOUT', 60))  # Inactivité max d'une connexion HTTP
+        self.state_file = 'state.json'  # Instantané écrit à la fermeture, relu au démarrage suivant
+        self.drain_timeout = int(os.environ.get('DRAIN_TIMEOUT', 120))  # Délai laissé aux transferts à la fermeture
+        # Admission progressive des connexions après le démarrage (afflux de 7h)
+        self.admission = TokenBucket(float(os.environ.get('ADMISSION_RATE', 50)),
+                                     float(os.environ.get('ADMISSION_BURST', 100)))
+        self.admission_warmup = int(os.environ.get('ADMISSION_WARMUP', 300))  # 0 pour désactiver
+        # Débit des transferts en octets/s, par utilisateur et global (0 = illimité), modifiable via /debug/bandwidth
+        self.bandwidth = {
+            direction: BandwidthShaper(int(os.environ.get(f'BANDWIDTH_{direction.upper()}_USER', 0)),
+                                       int(os.environ.get(f'BANDWIDTH_{direction.upper()}_GLOBAL', 0)))
+            for direction in ('in', 'out')
+        }
+        self.started_at = time.time()
+        # Connexions sans données: inactif (IDLE_TIMEOUT) une fois authentifié, sinon READ_TIMEOUT,
+        # qui vaut aussi pendant un transfert ou une trame incomplète
+        self.idle_timeout = int(os.environ.get('IDLE_TIMEOUT', 900))
+        self.read_timeout = int(os.environ.get('READ_TIMEOUT', 30))
+        # Limites par adresse IP et bannissements (banned.json), vérifiés dès accept()
+        self.guard = ConnectionGuard(
+            'banned.json',
+            max_connections=int(os.environ.get('MAX_CONNECTIONS', 1000)),
+            max_per_ip=int(os.environ.get('MAX_CONNECTIONS_PER_IP', 20)),
+            command_rate=float(os.environ.get('COMMAND_RATE', 20)),
+            command_burst=float(os.environ.get('COMMAND_BURST', 40)),
+            auth_rate=float(os.environ.get('AUTH_RATE', 0.5)),
+            auth_burst=float(os.environ.get('AUTH_BURST', 10)),
+            ban_after=int(os.environ.get('BAN_AFTER', 20)),
+            ban_duration=int(os.environ.get('BAN_DURATION', 900)))
+        # Proxys devant l'interface web (adresses séparées par des virgules, '*' pour tout pair):
+        # le client est alors l'adresse qu'ils ajoutent à X-Forwarded-For. Sur Render, tout
+        # passe par le proxy de la plateforme.
+        self.trusted_proxies = set(filter(None, (address.strip() for address in os.environ.get(
+            'TRUSTED_PROXIES', '*' if 'RENDER' in os.environ else '').split(','))))
+        self.active_sessions = set()  # Connexions ouvertes, pour la fermeture planifiée
+        self.metrics = Metrics()  # Exposées sur /metrics (format Prometheus)
+        self.profiler = SamplingProfiler()  # Activable à chaud via /debug/profile
+        # Protège /metrics s'il est défini; les routes /debug ne sont accessibles qu'avec ce jeton
+        self.metrics_token = os.environ.get('METRICS_TOKEN')
+        self.status_page = StatusPage(self)  # Page web de statut, rendue au plus une fois par seconde
+        self.hot_cache = HotFileCache(int(os.environ.get('HOT_CACHE_SIZE', 64 * 1024 * 1024)),  # 0 pour désactiver
+                                      int(os.environ.get('HOT_CACHE_MAX_FILE', 8 * 1024 * 1024)))
         
         # Créer le répertoire pour les fichiers s'il n'existe pas
-        if not os.path.exists(self.files_dir):
-            os.makedirs(self.files_dir)
+        for directory in (self.files_dir, self.uploads_dir, self.compressed_dir):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
             
+        if self.storage_mode == 'cas':
+            self.storage = ContentStore(self.cas_dir, self.cas_chunk_size)
+        else:
+            self.storage = FlatStorage(self.files_dir)
+        
+        # Catalogue des fichiers partagés, reconstruit depuis le disque au premier accès
+        self.catalog = FileCatalog(self.catalog_file, self.storage)
+        self.catalog.start()
+        
         # Charger les comptes existants
         self.accounts = self.load_accounts()
+        
+        # Recharger les sessions (jetons) encore valides
+        self.sessions = SessionTable(self.sessions_file, self.session_ttl, self.max_sessions_per_user)
+        self.sessions.start()
+        
+        # Recharger l'historique du chat
+        # Avec plusieurs workers, seul le worker 0 écrit le journal; les autres en gardent une copie
+        self.chat_history = ChatHistory(self.chat_log_file, self.chat_history_size, self.legacy_chat_file,
+                                        replica=bool(self.worker_id))
+        
+        # Reprendre les transferts par blocs interrompus
+        self.chunked_uploads = self.load_chunked_uploads()
+        self.chunked_uploads_lock = threading.Lock()
+        
+        self.describe_metrics()
+        
+        # Relais du chat, de la présence, des sessions et des fichiers entre workers
+        self.remote_clients = collections.defaultdict(set)  # worker -> utilisateurs connectés
+        self.bus = None
+        if self.worker_id is not None:
+            if self.account_store == 'journal':
+                print("[Workers] Attention: ACCOUNT_STORE=journal n'est pas partagé entre processus")
+            self.bus = WorkerBus(self, self.bus_path, self.worker_id)
+            self.sessions.listener = self.bus.relay_session
+            self.bus.start()
+        
+        # Reprendre l'état de la dernière fermeture (cache, catalogue) en arrière-plan
+        self.restore_state()
+    
+    # Commandes suivies individuellement; les autres sont regroupées (cardinalité bornée)
+    COMMANDS = ('REGISTER', 'LOGIN', 'RESUME', 'LOGOUT', 'LIST', 'CHAT', 'HISTORY', 'STATS', 'HAVE',
+                'UPLOAD', 'UPLOAD_CHUNK', 'UPLOAD_INIT', 'UPLOAD_STATUS', 'UPLOAD_COMMIT', 'DOWNLOAD', 'FRAMING', 'PING')
+    
+    def describe_metrics(self):
+        """Déclare les métriques exposées sur /metrics"""
+        metrics = self.metrics
+        metrics.describe('commands_total', 'counter', "Commandes traitées, par commande")
+        metrics.describe('command_duration_seconds', 'histogram', "Durée de traitement d'une commande, transfert compris")
+        metrics.describe('transfer_bytes_total', 'counter', "Octets de fichiers reçus (in) et envoyés (out)")
+        metrics.describe('connections_total', 'counter', "Connexions acceptées")
+        metrics.describe('connections_active', 'gauge', "Connexions ouvertes")
+        metrics.describe('connections_refused_total', 'counter', "Connexions refusées dès accept(), par motif")
+        metrics.describe('connections_timed_out_total', 'counter', "Connexions fermées faute de données")
+        metrics.describe('commands_throttled_total', 'counter', "Commandes refusées par la limite par adresse IP")
+        metrics.describe('commands_paced_total', 'counter', "Commandes au-delà du débit par adresse IP, ralenties")
+        metrics.describe('banned_addresses', 'gauge', "Adresses bannies",
+                         lambda: len(self.guard.banned))
+        metrics.describe('chat_fanout_seconds', 'histogram', "Durée de diffusion d'un message du chat")
+        metrics.describe('auth_seconds', 'histogram', "Durée d'une vérification de mot de passe")
+        metrics.describe('kdf_pending', 'gauge', "Calculs de mots de passe en cours ou en attente")
+        metrics.describe('chat_outbox_messages', 'gauge', "Messages en attente dans les files sortantes",
+                         lambda: sum(len(getattr(session, 'outbox', ())) for session in list(self.broadcaster.sessions)))
+        metrics.describe('chat_subscribers', 'gauge', "Clients abonnés au chat",
+                         lambda: len(self.broadcaster.sessions))
+        metrics.describe('sse_streams', 'gauge', "Flux SSE du chat ouverts")
+        metrics.describe('sessions_tokens', 'gauge', "Jetons de session valides",
+                         lambda: len(self.sessions.tokens))
+        metrics.describe('chunked_uploads_pending', 'gauge', "Transferts par blocs en cours",
+                         lambda: len(self.chunked_uploads))
+        metrics.describe('hot_cache', 'gauge', "Cache des fichiers populaires",
+                         lambda: {(('stat', key),): value for key, value in self.hot_cache.stats().items()})
+        metrics.describe('bandwidth_wait_seconds_total', 'counter', "Attente imposée aux transferts par la limite de débit",
+                         lambda: {(('direction', direction),): shaper.waited for direction, shaper in self.bandwidth.items()})
+        metrics.describe('users_online', 'gauge', "Utilisateurs connectés, tous workers confondus",
+                         lambda: len(self.online_users()))
+        metrics.describe('profiler_running', 'gauge', "Profileur par échantillonnage actif",
+                         lambda: int(self.profiler.running))
+    
+    def record_command(self, command, started):
+        """Compte une commande et sa durée depuis started (time.perf_counter)"""
+        label = command if command in self.COMMANDS else 'AUTRE'
+        self.metrics.inc('commands_total', command=label)
+        self.metrics.observe('command_duration_seconds', time.perf_counter() - started, command=label)
+    
+    def get_local_time(self):
+        """Retourne l'heure locale avec le décalage de fuseau"""
+        return datetime.utcnow() + timedelta(hours=self.timezone_offset)
+    
+    def format_chat(self, record):
+        """Met en forme un message du chat: "user [HH:MM:SS]: texte"""
+        local_time = datetime.utcfromtimestamp(record['timestamp']) + timedelta(hours=self.timezone_offset)
+        return f"{record['user']} [{local_time.strftime('%H:%M:%S')}]: {record['text']}"
+    
+    def is_within_time_window(self):
+        """Vérifie si l'heure actuelle est dans la plage autorisée (7h-22h)"""
+        current_hour = self.get_local_time().hour
+        return self.start_hour <= current_hour < self.end_hour
+    
+    def admission_delay(self):
+        """Attente imposée à une nouvelle connexion pendant la montée en charge du démarrage"""
+        if time.time() - self.started_at > self.admission_warmup:
+            return 0
+        return self.admission.reserve()
+    
+    def throttle(self, session, command):
+        """Réponse de refus si l'adresse du client dépasse son quota d'authentification, sinon None
+        
+        Au-delà du débit de commandes, la lecture suivante de la session est
+        retardée (session.pause): le client est freiné, ses commandes aboutissent.
+        """
+        delay = self.guard.pace(session.address[0], command)
+        if delay > session.pause:
+            session.pause = delay
+            self.metrics.inc('commands_paced_total')
+        verdict = self.guard.check_command(session.address[0], command)
+        if verdict is None:
+            return None
+        self.metrics.inc('commands_throttled_total', command=command if command in self.COMMANDS else 'AUTRE')
+        if verdict == 'banned':
+            session.closing = True
+            return "ERREUR Trop de requêtes: adresse bannie temporairement"
+        return "ERREUR Trop de requêtes, réessayez plus tard"
+    
+    def is_trusted_proxy(self, address):
+        """Adresse d'un proxy de confiance devant l'interface web (TRUSTED_PROXIES)"""
+        return '*' in self.trusted_proxies or address in self.trusted_proxies
+    
+    def refuse_connection(self, address, per_ip=True):
+        """Motif de refus d'une nouvelle connexion (compté), ou None si elle est admise"""
+        refused = self.guard.admit(address[0], per_ip)
+        if refused is not None:
+            self.metrics.inc('connections_refused_total', reason=refused)
+        return refused
+    
+    def begin_drain(self):
+        """Fermeture planifiée: les connexions inactives sont fermées, les transferts en cours continuent"""
+        busy = 0
+        for session in list(self.active_sessions):
+            session.closing = True
+            if session.busy:
+                busy += 1
+            else:
+                session.stop_reading()
+        print(f"[Arrêt] {busy} transfert(s) en cours, échéance dans {self.drain_timeout}s")
+        return time.time() + self.drain_timeout
+    
+    def end_drain(self):
+        """Échéance de la fermeture: coupe les transferts restants et sauvegarde l'état"""
+        remaining = list(self.active_sessions)
+        for session in remaining:
+            session.disconnect()
+        if remaining:
+            print(f"[Arrêt] {len(remaining)} connexion(s) coupée(s) à l'échéance")
+        self.save_state()
+    
+    def drain(self):
+        """Fermeture planifiée du moteur à threads"""
+        deadline = self.begin_drain()
+        while self.active_sessions and time.time() < deadline:
+            time.sleep(0.2)
+        self.end_drain()
+    
+    async def drain_async(self):
+        """Fermeture planifiée du moteur asyncio"""
+        deadline = self.begin_drain()
+        while self.active_sessions and time.time() < deadline:
+            await asyncio.sleep(0.2)
+        self.end_drain()
+    
+    def save_state(self):
+        """Instantané de l'état en mémoire, relu par restore_state au démarrage suivant
+        
+        Sessions, catalogue et chat ont leurs propres fichiers (écrits ici sans
+        attendre leur sauvegarde périodique); state.json garde en plus la liste des
+        fichiers du cache, pour le réchauffer avant les téléchargements du matin.
+        """
+        self.sessions.purge()
+        self.sessions.save()
+        self.catalog.save()
+        self.chat_history.sync()
+        state = {
+            'saved_at': time.time(),
+            'hot_files': self.hot_cache.paths(),
+            'chat_last_id': self.chat_history.last_id,
+        }
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        fd, temp_path = tempfile.mkstemp(prefix='.state-', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_file)
+        print(f"[Arrêt] État sauvegardé ({len(state['hot_files'])} fichiers en cache)")
+    
+    def restore_state(self):
+        """Relit l'instantané de la dernière fermeture et réchauffe catalogue et cache en arrière-plan"""
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        # Seuls les fichiers du stockage peuvent être rechargés
+        roots = [os.path.abspath(directory) + os.sep for directory in (self.files_dir, self.cas_dir)]
+        hot_files = [path for path in state.get('hot_files', [])
+                     if isinstance(path, str) and os.path.abspath(path).startswith(tuple(roots))]
+        threading.Thread(target=self.warm_up, args=(hot_files,), daemon=True).start()
+    
+    def warm_up(self, hot_files):
+        # Réconcilier le catalogue avec le disque avant les premiers LIST
+        self.catalog.names()
+        for path in hot_files:
+            self.hot_cache.get(path)
+    
+    def load_accounts(self):
+        """Ouvre le stockage des comptes choisi par ACCOUNT_STORE"""
+        if self.account_store == 'sqlite':
+            return SqliteAccountStore(self.accounts_db, self.accounts_file)
+        return JournalAccountStore(self.accounts_file)
+    
+    def hash_password(self, password):
+        """Empreinte salée avec le KDF configuré, paramètres inclus"""
+        salt = os.urandom(16)
+        if self.password_kdf == 'pbkdf2':
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, self.pbkdf2_iterations)
+            return f"pbkdf2_sha256${self.pbkdf2_iterations}${salt.hex()}${digest.hex()}"
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=self.scrypt_n, r=self.scrypt_r,
+                                p=self.scrypt_p, dklen=32)
+        return f"scrypt${self.scrypt_n}${self.scrypt_r}${self.scrypt_p}${salt.hex()}${digest.hex()}"
+    
+    def verify_password(self, stored, password):
+        """Vérifie un mot de passe; retourne (valide, à re-hacher avec les paramètres actuels)"""
+        fields = stored.split('$')
+        if fields[0] == 'scrypt' and len(fields) == 6:
+            n, r, p = int(fields[1]), int(fields[2]), int(fields[3])
+            digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(fields[4]), n=n, r=r, p=p,
+                                    dklen=len(fields[5]) // 2)
+            current = self.password_kdf == 'scrypt' and (n, r, p) == (self.scrypt_n, self.scrypt_r, self.scrypt_p)
+            return hmac.compare_digest(digest.hex(), fields[5]), not current
+        if fields[0] == 'pbkdf2_sha256' and len(fields) == 4:
+            iterations = int(fields[1])
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(fields[2]), iterations)
+            current = self.password_kdf == 'pbkdf2' and iterations == self.pbkdf2_iterations
+            return hmac.compare_digest(digest.hex(), fields[3]), not current
+        # Ancien format: SHA-256 sans sel, toujours à re-hacher
+        digest = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(digest, stored), True
+    
+    def run_kdf(self, function, *args):
+        """Exécute un calcul de mot de passe dans le pool dédié; None si le pool est saturé"""
+        if not self.kdf_slots.acquire(timeout=self.kdf_timeout):
+            return None
+        self.metrics.inc('kdf_pending')
+        try:
+            return self.kdf_pool.submit(function, *args).result()
+        finally:
+            self.metrics.inc('kdf_pending', -1)
+            self.kdf_slots.release()
+    
+    def register_account(self, username, password):
+        if username in self.accounts:
+            return False, "Nom d'utilisateur déjà existant"
+        
+        password_hash = self.run_kdf(self.hash_password, password)
+        if password_hash is None:
+            return False, "Serveur occupé, réessayez plus tard"
+        created = self.accounts.add(username, {
+            'password': password_hash,
+            'created_at': time.time()
+        })
+        if not created:
+            return False, "Nom d'utilisateur déjà existant"
+        return True, "Compte créé avec succès"
+    
+    def authenticate(self, username, password):
+        started = time.perf_counter()
+        success, message = self.check_credentials(username, password)
+        self.metrics.observe('auth_seconds', time.perf_counter() - started, result='ok' if success else 'echec')
+        return success, message
+    
+    def credentials_cached(self, username, password):
+        """Identifiants vérifiés récemment (CredentialCache): pas une nouvelle tentative de mot de passe"""
+        account = self.accounts.get(username)
+        return account is not None and self.credential_cache.check(username, account['password'], password)
+    
+    def check_credentials(self, username, password):
+        account = self.accounts.get(username)
+        if account is None:
+            return False, "Nom d'utilisateur incorrect"
+        
+        # Reconnexion récente: identifiants déjà vérifiés, pas de nouveau calcul
+        if self.credential_cache.check(username, account['password'], password):
+            return True, "Authentification réussie"
+        
+        result = self.run_kdf(self.verify_password, account['password'], password)
+        if result is None:
+            return False, "Serveur occupé, réessayez plus tard"
+        valid, needs_rehash = result
+        if not valid:
+            return False, "Mot de passe incorrect"
+        
+        if needs_rehash:
+            # Migration transparente vers le KDF et les paramètres actuels
+            password_hash = self.run_kdf(self.hash_password, password)
+            if password_hash is not None:
+                account = dict(account, password=password_hash)
+                self.accounts.update(username, account)
+        self.credential_cache.add(username, account['password'], password)
+        
+        return True, "Authentification réussie"
+    
+    def post_chat(self, username, text):
+        """Enregistre un message (CHAT ou POST /chat) et le diffuse; retourne son enregistrement
+        
+        Sur un worker autre que le 0, le message part au worker 0 qui lui attribue
+        son identifiant et le renvoie à tous: None est alors retourné.
+        """
+        if self.bus is not None and not self.bus.is_hub:
+            self.bus.publish({'type': 'chat', 'user': username, 'text': text, 'timestamp': time.time()})
+            return None
+        record = self.chat_history.append(username, text)
+        if self.bus is not None:
+            self.bus.publish({'type': 'chat_record', 'record': record})
+        self.deliver_chat(record)
+        return record
+    
+    def deliver_chat(self, record):
+        """Diffuse un message à tous les clients connectés à ce processus, sans bloquer l'émetteur"""
+        started = time.perf_counter()
+        self.broadcaster.publish(f"CHAT {self.format_chat(record)}")
+        self.metrics.observe('chat_fanout_seconds', time.perf_counter() - started)
+    
+    def online_users(self):
+        """Utilisateurs connectés à ce worker et aux autres"""
+        users = set(self.clients)
+        for remote in list(self.remote_clients.values()):
+            users |= remote
+        return users
+    
+    def detach_client(self, session):
+        """Retire la connexion de la table de présence"""
+        if session.username and self.clients.get(session.username) is session:
+            del self.clients[session.username]
+            if self.bus is not None:
+                self.bus.publish({'type': 'presence', 'user': session.username, 'online': False})
+    
+    def apply_bus_event(self, event):
+        """Applique un événement relayé par le bus depuis un autre worker"""
+        kind = event.get('type')
+        if kind == 'chat_record':
+            self.chat_history.add_replica(event['record'])
+            self.deliver_chat(event['record'])
+        elif kind == 'presence':
+            users = self.remote_clients[event['worker']]
+            if event.get('reset'):
+                users.clear()
+            elif event['online']:
+                users.add(event['user'])
+            else:
+                users.discard(event['user'])
+        elif kind == 'session':
+            self.sessions.apply(event['action'], event['token'], event.get('entry'))
+        elif kind == 'file':
+            self.file_published(event['name'], event['uploader'], event['sha256'], relay=False)
+        elif kind == 'bandwidth':
+            self.bandwidth[event['direction']].configure(event['user_rate'], event['global_rate'])
+    
+    def set_bandwidth(self, direction, user_rate=None, global_rate=None):
+        """Change à chaud les limites de débit d'un sens de transfert ('in' ou 'out'), sur tous les workers"""
+        shaper = self.bandwidth[direction]
+        shaper.configure(user_rate, global_rate)
+        if self.bus is not None:
+            self.bus.publish({'type': 'bandwidth', 'direction': direction, **shaper.limits()})
+        return shaper.limits()
+    
+    def load_chunked_uploads(self):
+        """Recharge l'index des transferts par blocs et purge ceux qui ont expiré"""
+        uploads = {}
+        for name in os.listdir(self.uploads_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                upload = ChunkedUpload.load(self.uploads_dir, name[:-5])
+            except (OSError, ValueError, KeyError):
+                continue
+            if time.time() - upload.created_at > self.chunked_upload_ttl:
+                upload.discard()
+            else:
+                uploads[upload.upload_id] = upload
+        return uploads
+    
+    def get_chunked_upload(self, session, upload_id):
+        """Retourne le transfert par blocs de l'utilisateur, ou None"""
+        upload = self.chunked_uploads.get(upload_id)
+        if upload is None and self.worker_id is not None and upload_id.isalnum():
+            # Transfert commencé sur un autre worker: son état est sur disque
+            try:
+                upload = ChunkedUpload.load(self.uploads_dir, upload_id)
+            except (OSError, ValueError, KeyError):
+                return None
+            with self.chunked_uploads_lock:
+                upload = self.chunked_uploads.setdefault(upload_id, upload)
+        if upload is None or upload.owner != session.username:
+            return None
+        return upload
+    
+    def attach_session(self, session, username, token, reply):
+        """Associe la connexion à un utilisateur authentifié (LOGIN ou RESUME); retourne la réponse à envoyer"""
+        session.username = username
+        session.authenticated = True
+        session.token = token
+        self.clients[username] = session
+        if self.bus is not None:
+            self.bus.publish({'type': 'presence', 'user': username, 'online': True})
+        self.broadcaster.register(session)
+        history = [f"CHAT_HISTORY {self.format_chat(record)}"
+                   for record in self.chat_history.recent(self.chat_replay_depth)]
+        if not session.framed:
+            # Ancien protocole, sans délimiteur: la réponse reste en tête et l'historique
+            # suit, un message par ligne; pas de jeton (RESUME suppose FRAMING LEN)
+            return "\n".join([reply] + history) + "\n" if history else reply
+        # Jeton et historique précèdent la réponse, chacun dans sa trame,
+        # regroupés avec elle en une seule écriture
+        session.send(f"SESSION {token}")
+        for line in history:
+            session.send(line)
+        return reply
+    
+    def prepare_upload(self, session, parts):
+        """Valide une commande UPLOAD ou UPLOAD_CHUNK; retourne (erreur, écrivain ou None)"""
+        if not session.authenticated:
+            return "ERREUR Vous devez être connecté pour uploader un fichier", None
+        
+        if parts[0] == 'UPLOAD_CHUNK':
+            # Format: UPLOAD_CHUNK upload_id index size, suivi des données du bloc
+            bounds = parts[2].split() if len(parts) > 2 else []
+            try:
+                if len(bounds) != 2:
+                    raise ValueError
+                index, size = int(bounds[0]), int(bounds[1])
+            except ValueError:
+                # La taille des données qui suivent est inconnue: la connexion est fermée
+                session.closing = True
+                return "ERREUR Format: UPLOAD_CHUNK upload_id index size", None
+            upload = self.get_chunked_upload(session, parts[1])
+            if upload is None:
+                session.closing = True
+                return f"ERREUR Transfert {parts[1]} inconnu", None
+            if not 0 <= index < upload.chunk_count or size != upload.chunk_length(index):
+                session.closing = True
+                return f"ERREUR Bloc {index} invalide pour {upload.filename}", None
+            return None, ChunkWriter(upload, index)
+        
+        # Format: UPLOAD filename filesize [comp=zlib|lzma|bz2] filedata
+        # (avec comp=, filesize est la taille compressée envoyée)
+        if len(parts) < 3:
+            return "ERREUR Format: UPLOAD filename filesize [comp=zlib|lzma|bz2]", None
+        filename = parts[1]
+        if not valid_filename(filename):
+            # Les données qui suivent ne seront pas lues: la connexion est fermée
+            session.closing = True
+            return f"ERREUR Nom de fichier invalide: {filename}", None
+        values = parts[2].split()
+        try:
+            filesize = int(values[0])
+        except (IndexError, ValueError):
+            # La taille des données qui suivent est inconnue: la connexion est fermée
+            session.closing = True
+            return "ERREUR Format: UPLOAD filename filesize [comp=zlib|lzma|bz2]", None
+        try:
+            compression = parse_options(values[1:]).get('comp')
+        except ValueError:
+            compression = ''
+        if compression is not None and compression not in COMPRESSORS:
+            session.closing = True
+            return f"ERREUR Compression non supportée (disponibles: {' '.join(COMPRESSORS)})", None
+        if filesize < 0 or filesize > self.max_upload_size:
+            # Les données qui suivent ne seront pas lues: la connexion est fermée
+            session.closing = True
+            return f"ERREUR Fichier trop volumineux (maximum {self.max_upload_size} octets)", None
+        if compression:
+            # Décompression au fil de l'eau: le stockage reçoit le contenu d'origine
+            return None, DecompressingWriter(self.storage.writer(filename, 0), compression, filesize,
+                                             self.max_upload_size)
+        return None, self.storage.writer(filename, filesize)
+    
+    def finish_upload(self, session, upload):
+        """Valide les données reçues si le transfert est complet"""
+        self.metrics.inc('transfer_bytes_total', upload.received, direction='in')
+        if upload.remaining:
+            upload.abort()
+            return f"ERREUR Transfert de {upload.filename} interrompu ({upload.received}/{upload.filesize} octets)"
+        if getattr(upload, 'error', None):
+            upload.abort()
+            return f"ERREUR {upload.error}"
+        message = upload.commit()
+        if not isinstance(upload, ChunkWriter):
+            self.file_published(upload.filename, session.username, upload.sha256)
+        return f"SUCCES {message}"
+    
+    def file_published(self, filename, uploader, sha256=None, relay=True):
+        """Met à jour le catalogue et libère l'ancienne version du cache après un UPLOAD"""
+        if relay and self.bus is not None:
+            # Les autres workers ont leur propre catalogue et leur propre cache
+            self.bus.publish({'type': 'file', 'name': filename, 'uploader': uploader, 'sha256': sha256})
+        self.hot_cache.invalidate(os.path.join(self.files_dir, filename))
+        # Les copies compressées de l'ancienne version ne serviront plus
+        prefix = hashlib.sha256(filename.encode()).hexdigest()[:32] + '-'
+        for name in os.listdir(self.compressed_dir):
+            if name.startswith(prefix):
+                try:
+                    os.unlink(os.path.join(self.compressed_dir, name))
+                except FileNotFoundError:
+                    pass
+        self.catalog.update(filename, uploader, sha256)
+    
+    def process_chunked_upload(self, session, parts):
+        """Commandes UPLOAD_INIT, UPLOAD_STATUS et UPLOAD_COMMIT des transferts par blocs"""
+        command = parts[0]
+        if not session.authenticated:
+            return "ERREUR Vous devez être connecté pour uploader un fichier"
+        
+        if command == 'UPLOAD_INIT':
+            # Format: UPLOAD_INIT filename filesize [chunksize]
+            values = parts[2].split() if len(parts) > 2 else []
+            try:
+                if not 1 <= len(values) <= 2:
+                    raise ValueError
+                filesize = int(values[0])
+                chunk_size = int(values[1]) if len(values) > 1 else self.chunk_size
+            except ValueError:
+                return "ERREUR Format: UPLOAD_INIT filename filesize [chunksize]"
+            if not valid_filename(parts[1]):
+                return f"ERREUR Nom de fichier invalide: {parts[1]}"
+            if filesize < 0 or filesize > self.max_upload_size:
+                return f"ERREUR Fichier trop volumineux (maximum {self.max_upload_size} octets)"
+            if not 0 < chunk_size <= self.max_chunk_size:
+                return f"ERREUR Taille de bloc invalide (maximum {self.max_chunk_size} octets)"
+            upload = ChunkedUpload.create(self.uploads_dir, parts[1], filesize, chunk_size, session.username)
+            with self.chunked_uploads_lock:
+                self.chunked_uploads[upload.upload_id] = upload
+            return f"SUCCES {upload.upload_id} {upload.chunk_size} {upload.chunk_count}"
+        
+        if len(parts) < 2:
+            return f"ERREUR Format: {command} upload_id"
+        upload = self.get_chunked_upload(session, parts[1])
+        if upload is None:
+            return f"ERREUR Transfert {parts[1]} inconnu"
+        
+        if self.worker_id is not None and not upload.refresh():
+            # Terminé ou abandonné depuis un autre worker
+            with self.chunked_uploads_lock:
+                self.chunked_uploads.pop(upload.upload_id, None)
+            return f"ERREUR Transfert {parts[1]} inconnu"
+        
+        if command == 'UPLOAD_STATUS':
+            # Blocs encore attendus, pour reprendre après une coupure
+            missing = upload.missing_chunks()
+            return "SUCCES " + " ".join(str(index) for index in missing) if missing else "SUCCES Complet"
+        
+        missing = upload.missing_chunks()
+        if missing:
+            return f"ERREUR {len(missing)} blocs manquants pour {upload.filename}"
+        with self.chunked_uploads_lock:
+            if self.chunked_uploads.pop(upload.upload_id, None) is None:
+                return f"ERREUR Transfert {parts[1]} inconnu"
+        try:
+            sha256 = upload.commit(self.storage)
+        except FileNotFoundError:
+            # Validé au même moment depuis un autre worker
+            return f"ERREUR Transfert {parts[1]} inconnu"
+        self.file_published(upload.filename, session.username, sha256)
+        return f"SUCCES Fichier {upload.filename} uploadé avec succès"
+    
+    def prepare_download(self, session, parts):
+        """Valide une commande DOWNLOAD; retourne (réponse, segments à envoyer ou None)
+        
+        Format: DOWNLOAD filename [offset [length]] pour reprendre un transfert
+        interrompu ou répartir un fichier sur plusieurs connexions.
+        """
+        if not session.authenticated:
+            return "ERREUR Vous devez être connecté pour télécharger un fichier", None
+        if len(parts) < 2:
+            return "ERREUR Format: DOWNLOAD filename [offset length] [comp=zlib|lzma|bz2]", None
+        filename = parts[1]
+        if not valid_filename(filename):
+            return f"ERREUR Nom de fichier invalide: {filename}", None
+        filesize = self.storage.size(filename)
+        if filesize is None:
+            return f"ERREUR Fichier {filename} non trouvé", None
+        
+        values = parts[2].split() if len(parts) > 2 else []
+        try:
+            compression = parse_options([value for value in values if '=' in value]).get('comp')
+            bounds = [int(value) for value in values if '=' not in value]
+        except ValueError:
+            return "ERREUR Format: DOWNLOAD filename [offset length] [comp=zlib|lzma|bz2]", None
+        
+        if compression is not None:
+            # Le flux compressé est servi depuis une copie compressée une seule fois;
+            # une plage porte alors sur les octets compressés (reprise possible)
+            if compression not in COMPRESSORS:
+                return f"ERREUR Compression non supportée (disponibles: {' '.join(COMPRESSORS)})", None
+            path = self.compressed_copy(filename, compression)
+            filesize = os.path.getsize(path)
+            suffix = f" comp={compression}"
+        else:
+            suffix = ""
+        # Sans tramage, l'en-tête se termine par une fin de ligne pour le séparer des données
+        end = "" if session.framed else "\n"
+        
+        if not bounds:
+            segments = [(path, 0, filesize)] if compression else self.storage.segments(filename, 0, filesize)
+            return f"SUCCES {filesize}{suffix}{end}", segments
+        
+        offset = bounds[0]
+        length = bounds[1] if len(bounds) > 1 else filesize - offset
+        if len(bounds) > 2 or offset < 0 or length < 0 or offset > filesize:
+            return f"ERREUR Plage invalide pour {filename} ({filesize} octets)", None
+        length = min(length, filesize - offset)
+        segments = [(path, offset, length)] if compression else self.storage.segments(filename, offset, length)
+        # Réponse d'un téléchargement partiel: longueur envoyée, début, taille totale
+        return f"SUCCES {length} {offset} {filesize}{suffix}{end}", segments
+    
+    def compressed_copy(self, filename, compression):
+        """Chemin de la copie compressée du fichier, créée au premier téléchargement compressé"""
+        entry = self.catalog.get(filename)
+        version = entry['sha256'] if entry and entry['sha256'] else \
+            f"{entry['mtime'] if entry else 0}-{self.storage.size(filename)}"
+        prefix = hashlib.sha256(filename.encode()).hexdigest()[:32]
+        path = os.path.join(self.compressed_dir, f"{prefix}-{version}.{compression}")
+        if os.path.exists(path):
+            return path
+        
+        filesize = self.storage.size(filename)
+        fd, temp_path = tempfile.mkstemp(prefix='.compress-', dir=self.compressed_dir)
+        compressor = COMPRESSORS[compression][0]()
+        with os.fdopen(fd, 'wb') as output:
+            for segment_path, offset, length in self.storage.segments(filename, 0, filesize):
+                with open(segment_path, 'rb') as f:
+                    f.seek(offset)
+                    while length:
+                        data = f.read(min(length, self.upload_buffer_size))
+                        if not data:
+                            break
+                        length -= len(data)
+                        output.write(compressor.compress(data))
+            output.write(compressor.flush())
+        os.replace(temp_path, path)
+        return path
+    
+    def process_command(self, session, parts):
+        """Exécute une commande de contrôle (hors transferts) et retourne la réponse"""
+        command = parts[0]
+        
+        if command == 'REGISTER':
+            if len(parts) < 3:
+                response = "ERREUR Format: REGISTER username password"
+            else:
+                success, message = self.register_account(parts[1], parts[2])
+                if success:
+                    response = f"SUCCES {message}"
+                else:
+                    response = f"ERREUR {message}"
+        
+        elif command == 'LOGIN':
+            if len(parts) < 3:
+                response = "ERREUR Format: LOGIN username password"
+            else:
+                success, message = self.authenticate(parts[1], parts[2])
+                if success:
+                    # Jeton de session pour les reconnexions sans mot de passe (RESUME)
+                    response = self.attach_session(session, parts[1], self.sessions.create(parts[1]),
+                                                   f"SUCCES {message}")
+                else:
+                    response = f"ERREUR {message}"
+        
+        elif command == 'RESUME':
+            if len(parts) < 2:
+                response = "ERREUR Format: RESUME token"
+            else:
+                token = parts[1].strip()
+                username = self.sessions.resume(token)
+                if username is None or username not in self.accounts:
+                    response = "ERREUR Session inconnue ou expirée"
+                else:
+                    response = self.attach_session(session, username, token, "SUCCES Session reprise")
+        
+        elif command == 'LOGOUT':
+            self.detach_client(session)
+            self.broadcaster.unregister(session)
+            if session.token:
+                self.sessions.revoke(session.token)
+            session.authenticated = False
+            session.username = None
+            session.token = None
+            response = "SUCCES Déconnecté avec succès"
+        
+        elif command == 'LIST':
+            if not session.authenticated:
+                response = "ERREUR Vous devez être connecté pour lister les fichiers"
+            elif len(parts) == 1 or not ' '.join(parts[1:]).strip():
+                # Forme d'origine: tous les noms sur une ligne, servis depuis le catalogue
+                files = self.catalog.names()
+                if not files:
+                    response = "SUCCES Aucun fichier disponible"
+                else:
+                    response = "SUCCES " + " ".join(files)
+            else:
+                # Format: LIST [prefix=] [sort=name|size|mtime] [order=asc|desc] [limit=] [cursor=]
+                try:
+                    options = parse_options(parts[1:])
+                    entries, cursor = self.catalog.query(
+                        prefix=options.get('prefix', ''),
+                        sort=options.get('sort', 'name'),
+                        descending=options.get('order', 'asc') == 'desc',
+                        limit=min(int(options.get('limit', 100)), self.max_list_page),
+                        cursor=options.get('cursor'))
+                except ValueError:
+                    entries = None
+                if entries is None:
+                    response = "ERREUR Format: LIST [prefix=] [sort=name|size|mtime] [order=asc|desc] [limit=] [cursor=]"
+                else:
+                    # Sans tramage, chaque ligne se termine par une fin de ligne, avant le SUCCES final
+                    end = "" if session.framed else "\n"
+                    for entry in entries:
+                        session.send(f"FILE {entry['size']} {entry['mtime']:.0f} {entry['uploader'] or '-'} "
+                                     f"{entry['sha256'] or '-'} {entry['name']}{end}")
+                    response = f"SUCCES {len(entries)} fichiers" + (f" cursor={cursor}" if cursor else "")
+        
+        elif command == 'CHAT':
+            if not session.authenticated:
+                response = "ERREUR Vous devez être connecté pour chatter"
+            else:
+                if len(parts) < 2:
+                    response = "ERREUR Format: CHAT message"
+                else:
+                    self.post_chat(session.username, parts[1])
+                    response = "SUCCES Message envoyé"
+        
+        elif command == 'HISTORY':
+            # Format: HISTORY [since=<ts>] [before=<ts>] [limit=<n>]
+            if not session.authenticated:
+                response = "ERREUR Vous devez être connecté pour consulter l'historique"
+            else:
+                try:
+                    options = parse_options(parts[1:])
+                    since = float(options['since']) if 'since' in options else None
+                    before = float(options['before']) if 'before' in options else None
+                    limit = min(int(options.get('limit', 50)), self.max_history_page)
+                except ValueError:
+                    options = None
+                if options is None:
+                    response = "ERREUR Format: HISTORY [since=<ts>] [before=<ts>] [limit=<n>]"
+                else:
+                    records = self.chat_history.query(since, before, limit)
+                    # Sans tramage, chaque ligne se termine par une fin de ligne, avant le SUCCES final
+                    end = "" if session.framed else "\n"
+                    for record in records:
+                        session.send(f"HISTORY {record['id']} {record['timestamp']!r} {self.format_chat(record)}{end}")
+                    response = f"SUCCES {len(records)} messages"
+        
+        elif command == 'STATS':
+            if not session.authenticated:
+                response = "ERREUR Vous devez être connecté pour consulter les statistiques"
+            else:
+                stats = self.hot_cache.stats()
+                response = "SUCCES cache " + " ".join(f"{key}={value}" for key, value in stats.items())
+        
+        elif command == 'HAVE':
+            # Format: HAVE filename sha256 — évite de renvoyer un contenu déjà stocké
+            if not session.authenticated:
+                response = "ERREUR Vous devez être connecté pour uploader un fichier"
+            elif len(parts) < 3:
+                response = "ERREUR Format: HAVE filename sha256"
+            elif not valid_filename(parts[1]):
+                response = f"ERREUR Nom de fichier invalide: {parts[1]}"
+            elif self.storage.link(parts[1], parts[2].strip().lower()):
+                self.file_published(parts[1], session.username, parts[2].strip().lower())
+                response = f"SUCCES Fichier {parts[1]} uploadé avec succès"
+            else:
+                response = "ERREUR Contenu inconnu"
+        
+        elif command in ('UPLOAD_INIT', 'UPLOAD_STATUS', 'UPLOAD_COMMIT'):
+            response = self.process_chunked_upload(session, parts)
+        
+        elif command == 'FRAMING':
+            # Négociation du tramage: la réponse part encore dans l'ancien mode
+            if len(parts) < 2 or parts[1].strip().upper() != 'LEN':
+                response = "ERREUR Format: FRAMING LEN"
+            else:
+                session.send("SUCCES FRAMING LEN")
+                session.parser.mode = 'length'
+                response = None
+        
+        elif command == 'PING':
+            # Maintien de connexion: remet à zéro le délai d'inactivité (IDLE_TIMEOUT)
+            response = "SUCCES PONG"
+        
+        else:
+            response = "ERREUR Commande non reconnue"
+        
+        return response
+    
+    def handle_client(self, client_socket, address):
+        """Boucle d'une connexion en mode thread (un thread par client)"""
+        print(f"[Nouvelle connexion] {address} connecté.")
+        session = ClientSession(address, client_socket, self.max_frame_size, self.chat_queue_size)
+        parser = session.parser
+        self.metrics.inc('connections_total', engine='threads')
+        self.metrics.inc('connections_active', engine='threads')
+        self.active_sessions.add(session)
+        set_keepalive(client_socket)
+        timeout = None
+        
+        try:
+            while True:
+                # Recevoir les commandes du client, sans attendre indéfiniment
+                if session.pause:
+                    # Débit de commandes dépassé: TCP freine le client au lieu de refuser ses commandes
+                    time.sleep(session.pause)
+                    session.pause = 0
+                wanted = self.idle_timeout if session.authenticated and not parser.buffer else self.read_timeout
+                if wanted != timeout:
+                    timeout = set_receive_timeout(client_socket, wanted)
+                try:
+                    data = client_socket.recv(self.recv_buffer_size)
+                except BlockingIOError:
+                    if wanted == self.idle_timeout and time.monotonic() - session.last_sent < self.idle_timeout:
+                        # Client à l'écoute du chat: les messages qu'il reçoit le maintiennent actif
+                        continue
+                    raise
+                if not data:
+                    break
+                parser.feed(data)
+                
+                # Les réponses d'un même lot partent en un seul envoi
+                session.cork()
+                try:
+                    while not session.closing:
+                        frame = parser.next_frame()
+                        if frame is None:
+                            break
+                        
+                        parts = frame.decode('utf-8').split(' ', 2)
+                        command = parts[0]
+                        started = time.perf_counter()
+                        session.busy = command in ('UPLOAD', 'UPLOAD_CHUNK', 'DOWNLOAD')
+                        response = self.throttle(session, command)
+                        
+                        if response is not None:
+                            pass
+                        
+                        elif command in ('UPLOAD', 'UPLOAD_CHUNK'):
+                            response, upload = self.prepare_upload(session, parts)
+                            if upload is not None:
+                                # Recevoir les données du fichier (d'abord celles déjà lues)
+                                # directement sur disque via un tampon de taille fixe
+                                shaper = self.bandwidth['in']
+                                if timeout != self.read_timeout:
+                                    timeout = set_receive_timeout(client_socket, self.read_timeout)
+                                try:
+                                    upload.write(parser.take(upload.remaining))
+                                    view = memoryview(bytearray(self.upload_buffer_size))
+                                    while upload.remaining:
+                                        received = client_socket.recv_into(view, min(len(view), upload.remaining))
+                                        if not received:
+                                            break
+                                        upload.write(view[:received])
+                                        # Limite de débit: la lecture suivante attend, TCP freine l'émetteur
+                                        shaper.wait(session.username, received)
+                                finally:
+                                    response = self.finish_upload(session, upload)
+                        
+                        elif command == 'DOWNLOAD':
+                            response, segments = self.prepare_download(session, parts)
+                            if segments is not None:
+                                # L'en-tête précède les données, envoyées sans copie par sendfile
+                                session.send(response)
+                                session.flush()
+                                response = None
+                                shaper = self.bandwidth['out']
+                                for path, offset, length in segments:
+                                    # Fichier populaire: tampon partagé en mémoire, sinon sendfile
+                                    buffer = self.hot_cache.get(path)
+                                    f = open(path, 'rb') if buffer is None else None
+                                    try:
+                                        # Par tranches si le débit est limité, pour alterner avec les autres transferts
+                                        for start, size in shaper.slices(offset, length):
+                                            shaper.wait(session.username, size)
+                                            if f is None:
+                                                client_socket.sendall(buffer[start:start + size])
+                                            else:
+                                                client_socket.sendfile(f, start, size)
+                                    finally:
+                                        if f is not None:
+                                            f.close()
+                                self.metrics.inc('transfer_bytes_total', sum(segment[2] for segment in segments),
+                                                 direction='out')
+                        
+                        else:
+                            response = self.process_command(session, parts)
+                        
+                        # Envoyer la réponse
+                        if response is not None:
+                            session.send(response)
+                        self.record_command(command, started)
+                        session.busy = False
+                finally:
+                    session.uncork()
+                if session.closing:
+                    break
+        
+        except BlockingIOError:
+            # Délai de SO_RCVTIMEO écoulé sans données
+            self.metrics.inc('connections_timed_out_total')
+            print(f"[Inactivité] {address} sans données depuis {timeout}s.")
+        
+        except Exception as e:
+            print(f"Erreur avec {address}: {e}")
+        
+        finally:
+            self.metrics.inc('connections_active', -1, engine='threads')
+            self.guard.release(address[0])
+            self.active_sessions.discard(session)
+            self.broadcaster.unregister(session)
+            self.detach_client(session)
+            client_socket.close()
+            print(f"[Déconnexion] {address} déconnecté.")
+    
+    async def handle_client_async(self, reader, writer):
+        """Boucle d'une connexion en mode asyncio (toutes les connexions sur une seule boucle)"""
+        address = writer.get_extra_info('peername')
+        refused = self.refuse_connection(address)
+        if refused is not None:
+            # Refus avant toute allocation: une rafale ne coûte qu'un accept()
+            writer.write(f"ERREUR {ConnectionGuard.REFUSALS[refused]}".encode('utf-8'))
+            writer.close()
+            return
+        delay = self.admission_delay()
+        if delay:
+            # Afflux du démarrage: la connexion attend son tour avant d'être servie
+            await asyncio.sleep(delay)
+        print(f"[Nouvelle connexion] {address} connecté.")
+        session = AsyncClientSession(address, writer, self.max_frame_size, self.chat_queue_size)
+        parser = session.parser
+        self.metrics.inc('connections_total', engine='asyncio')
+        self.metrics.inc('connections_active', engine='asyncio')
+        self.active_sessions.add(session)
+        
+        set_keepalive(writer.get_extra_info('socket'))
+        
+        try:
+            while True:
+                if session.pause:
+                    await asyncio.sleep(session.pause)
+                    session.pause = 0
+                timeout = self.idle_timeout if session.authenticated and not parser.buffer else self.read_timeout
+                try:
+                    data = await asyncio.wait_for(reader.read(self.recv_buffer_size), timeout)
+                except asyncio.TimeoutError:
+                    if timeout == self.idle_timeout and time.monotonic() - session.last_sent < self.idle_timeout:
+                        continue
+                    raise
+                if not data:
+                    break
+                parser.feed(data)
+                
+                session.cork()
+                try:
+                    while not session.closing:
+                        frame = parser.next_frame()
+                        if frame is None:
+                            break
+                        
+                        parts = frame.decode('utf-8').split(' ', 2)
+                        command = parts[0]
+                        started = time.perf_counter()
+                        session.busy = command in ('UPLOAD', 'UPLOAD_CHUNK', 'DOWNLOAD')
+                        response = self.throttle(session, command)
+                        
+                        if response is not None:
+                            pass
+                        
+                        elif command in ('UPLOAD', 'UPLOAD_CHUNK'):
+                            response, upload = self.prepare_upload(session, parts)
+                            if upload is not None:
+                                shaper = self.bandwidth['in']
+                                # Hachage, décompression et écriture disque hors de la boucle:
+                                # les autres connexions ne s'arrêtent pas pendant un UPLOAD
+                                loop = asyncio.get_running_loop()
+                                try:
+                                    await loop.run_in_executor(None, upload.write, parser.take(upload.remaining))
+                                    while upload.remaining:
+                                        packet = await asyncio.wait_for(
+                                            reader.read(min(self.upload_buffer_size, upload.remaining)),
+                                            self.read_timeout)
+                                        if not packet:
+                                            break
+                                        await loop.run_in_executor(None, upload.write, packet)
+                                        await shaper.wait_async(session.username, len(packet))
+                                finally:
+                                    response = await loop.run_in_executor(None, self.finish_upload, session, upload)
+                        
+                        elif command == 'DOWNLOAD':
+                            if len(parts) > 2 and 'comp=' in parts[2]:
+                                # La première compression d'un fichier ne doit pas bloquer la boucle
+                                response, segments = await asyncio.get_running_loop().run_in_executor(
+                                    None, self.prepare_download, session, parts)
+                            else:
+                                response, segments = self.prepare_download(session, parts)
+                            if segments is not None:
+                                session.send(response)
+                                session.flush()
+                                response = None
+                                await writer.drain()
+                                shaper = self.bandwidth['out']
+                                for path, offset, length in segments:
+                                    # Le chargement d'un fichier dans le cache (ou l'attente d'un autre
+                                    # thread qui le charge) lit le disque: hors de la boucle
+                                    buffer = await asyncio.get_running_loop().run_in_executor(
+                                        None, self.hot_cache.get, path)
+                                    f = open(path, 'rb') if buffer is None else None
+                                    try:
+                                        for start, size in shaper.slices(offset, length):
+                                            await shaper.wait_async(session.username, size)
+                                            if f is None:
+                                                writer.write(buffer[start:start + size])
+                                                await writer.drain()
+                                            else:
+                                                await asyncio.get_running_loop().sendfile(
+                                                    writer.transport, f, start, size)
+                                    finally:
+                                        if f is not None:
+                                            f.close()
+                                self.metrics.inc('transfer_bytes_total', sum(segment[2] for segment in segments),
+                                                 direction='out')
+                        
+                        elif command in ('LOGIN', 'REGISTER', 'UPLOAD_COMMIT'):
+                            # Le calcul du mot de passe et l'assemblage d'un transfert par blocs
+                            # (relu et haché en entier par le stockage cas) ne doivent pas bloquer la boucle
+                            response = await asyncio.get_running_loop().run_in_executor(
+                                None, self.process_command, session, parts)
+                        
+                        else:
+                            response = self.process_command(session, parts)
+                        
+                        if response is not None:
+                            session.send(response)
+                        self.record_command(command, started)
+                        session.busy = False
+                finally:
+                    session.uncork()
+                await writer.drain()
+                if session.closing:
+                    break
+        
+        except asyncio.TimeoutError:
+            self.metrics.inc('connections_timed_out_total')
+            print(f"[Inactivité] {address} sans données depuis {timeout}s.")
+        
+        except Exception as e:
+            print(f"Erreur avec {address}: {e}")
+        
+        finally:
+            self.metrics.inc('connections_active', -1, engine='asyncio')
+            self.guard.release(address[0])
+            self.active_sessions.discard(session)
+            self.broadcaster.unregister(session)
+            self.detach_client(session)
+            writer.close()
+            print(f"[Déconnexion] {address} déconnecté.")
+
+class FileCatalog:
+    """Catalogue en mémoire des fichiers partagés (taille, date, auteur, SHA-256)
+    
+    Tenu à jour par les UPLOAD, il répond à LIST sans toucher au disque. Il est
+    sauvegardé dans files.json par un thread périodique et réconcilié avec le
+    stockage au premier accès après le démarrage (les fichiers ajoutés ou
+    supprimés hors du serveur sont pris en compte à ce moment-là).
+    """
+    
+    SORT_KEYS = ('name', 'size', 'mtime')
+    
+    def __init__(self, catalog_file, storage, save_interval=10):
+        self.catalog_file = catalog_file
+        self.storage = storage
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.entries = None
+        self.version = 0
+        self.views = {}
+        self.dirty = False
+    
+    def start(self):
+        threading.Thread(target=self._save_loop, daemon=True).start()
+    
+    def _ensure_loaded(self):
+        """Réconcilie files.json avec le stockage (verrou tenu)"""
+        if self.entries is not None:
+            return
+        try:
+            with open(self.catalog_file, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        entries = {}
+        for name in self.storage.list():
+            info = self.storage.stat(name)
+            if info is None:
+                continue
+            previous = saved.get(name)
+            if previous and previous.get('size') == info['size'] and previous.get('mtime') == info['mtime']:
+                entries[name] = dict(previous, name=name)
+            else:
+                entries[name] = {'name': name, 'size': info['size'], 'mtime': info['mtime'],
+                                 'uploader': None, 'sha256': info['sha256']}
+        self.entries = entries
+        self.dirty = {name: {key: value for key, value in entry.items() if key != 'name'}
+                      for name, entry in entries.items()} != saved
+        self.version += 1
+    
+    def update(self, name, uploader, sha256=None):
+        """Enregistre un fichier qui vient d'être publié"""
+        info = self.storage.stat(name)
+        if info is None:
+            return
+        with self.lock:
+            self._ensure_loaded()
+            self.entries[name] = {'name': name, 'size': info['size'], 'mtime': info['mtime'],
+                                  'uploader': uploader, 'sha256': sha256 or info['sha256']}
+            self.version += 1
+            self.dirty = True
+    
+    def _view(self, sort):
+        """Entrées triées par (clé, nom), recalculées seulement après une modification"""
+        view = self.views.get(sort)
+        if view is None or view[0] != self.version:
+            ordered = sorted(self.entries.values(), key=lambda entry: (entry[sort], entry['name']))
+            view = (self.version, [(entry[sort], entry['name']) for entry in ordered], ordered)
+            self.views[sort] = view
+        return view[1], view[2]
+    
+    def get(self, name):
+        with self.lock:
+            self._ensure_loaded()
+            entry = self.entries.get(name)
+            return dict(entry) if entry else None
+    
+    def names(self):
+        with self.lock:
+            self._ensure_loaded()
+            return [entry['name'] for entry in self._view('name')[1]]
+    
+    def query(self, prefix='', sort='name', descending=False, limit=100, cursor=None):
+        """Une page d'entrées et le curseur de la page suivante (None à la fin)
+        
+        Le curseur désigne la dernière entrée renvoyée: la pagination reste
+        cohérente même si des fichiers sont ajoutés entre deux pages.
+        """
+        if sort not in self.SORT_KEYS or limit <= 0:
+            raise ValueError(sort)
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode())) if cursor else None
+        if after is not None:
+            # Curseur fourni par le client: [valeur de la clé de tri, nom], comparable aux clés du tri
+            kind = str if sort == 'name' else (int, float)
+            if (not isinstance(after, list) or len(after) != 2 or not isinstance(after[1], str)
+                    or not isinstance(after[0], kind) or isinstance(after[0], bool)):
+                raise ValueError(cursor)
+        with self.lock:
+            self._ensure_loaded()
+            keys, ordered = self._view(sort)
+            if descending:
+                keys, ordered = keys[::-1], ordered[::-1]
+            start = 0
+            if after is not None:
+                after = tuple(after)
+                if descending:
+                    start = len(keys) - bisect.bisect_left(keys[::-1], after)
+                else:
+                    start = bisect.bisect_right(keys, after)
+            elif prefix and sort == 'name' and not descending:
+                start = bisect.bisect_left(keys, (prefix, ''))
+            page = []
+            for entry in ordered[start:]:
+                if not entry['name'].startswith(prefix):
+                    if sort == 'name' and not descending and entry['name'] > prefix:
+                        break
+                    continue
+                if len(page) == limit:
+                    last = page[-1]
+                    token = json.dumps([last[sort], last['name']]).encode()
+                    return page, base64.urlsafe_b64encode(token).decode()
+                page.append(dict(entry))
+            return page, None
+    
+    def save(self):
+        with self.lock:
+            if not self.dirty or self.entries is None:
+                return
+            snapshot = {name: {key: value for key, value in entry.items() if key != 'name'}
+                        for name, entry in self.entries.items()}
+            self.dirty = False
+        directory = os.path.dirname(os.path.abspath(self.catalog_file))
+        fd, temp_path = tempfile.mkstemp(prefix='.files-', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, self.catalog_file)
+    
+    def _save_loop(self):
+        while True:
+            time.sleep(self.save_interval)
+            self.save()
+
+class HotFileCache:
+    """Cache LRU du contenu des fichiers souvent téléchargés, borné en octets
+    
+    Les entrées sont indexées par (chemin, mtime, taille): un fichier remplacé
+    n'est jamais servi périmé. Les téléchargements simultanés d'un même fichier
+    partagent un seul tampon via des memoryview, et un seul d'entre eux le lit.
+    """
+    
+    def __init__(self, capacity, max_file_size):
+        self.capacity = capacity
+        self.max_file_size = max_file_size
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, path):
+        """Contenu du fichier en memoryview, ou None s'il ne doit pas être mis en cache"""
+        if self.capacity <= 0:
+            return None
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        key = (path, info.st_mtime_ns, info.st_size)
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return memoryview(data)
+            self.misses += 1
+            if info.st_size > self.max_file_size or info.st_size > self.capacity:
+                return None
+            # Un seul lecteur par fichier: les autres attendent son chargement
+            loaded = self.loading.get(key)
+            if loaded is None:
+                loaded = self.loading[key] = threading.Event()
+                loader = True
+            else:
+                loader = False
+        
+        if not loader:
+            loaded.wait()
+            with self.lock:
+                data = self.entries.get(key)
+            return memoryview(data) if data is not None else None
+        
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if len(data) != info.st_size:
+                return None  # Fichier modifié pendant la lecture
+            with self.lock:
+                self.entries[key] = data
+                self.size += len(data)
+                while self.size > self.capacity:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+                    self.evictions += 1
+            return memoryview(data)
+        except OSError:
+            return None
+        finally:
+            with self.lock:
+                del self.loading[key]
+            loaded.set()
+    
+    def paths(self):
+        """Chemins en cache, du moins récemment au plus récemment utilisé"""
+        with self.lock:
+            return [key[0] for key in self.entries]
+    
+    def invalidate(self, path):
+        """Libère toutes les versions en cache d'un fichier"""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == path]:
+                self.size -= len(self.entries.pop(key))
+    
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'bytes': self.size}
+
+# Compressions négociables par transfert: (compresseur, décompresseur) en flux
+COMPRESSORS = {
+    'zlib': (zlib.compressobj, zlib.decompressobj),
+    'lzma': (lzma.LZMACompressor, lzma.LZMADecompressor),
+    'bz2': (bz2.BZ2Compressor, bz2.BZ2Decompressor),
+}
+
+class DecompressingWriter:
+    """Décompresse un UPLOAD au fil de l'eau vers l'écrivain du stockage
+    
+    remaining compte les octets compressés attendus. La sortie est produite par
+    blocs bornés et limitée à max_output octets (protection contre les bombes de
+    décompression). Une erreur n'interrompt pas la lecture, pour que le flux
+    reste synchronisé, et est signalée à la fin du transfert.
+    """
+    
+    def __init__(self, writer, compression, filesize, max_output, block_size=256 * 1024):
+        self.writer = writer
+        self.compression = compression
+        self.filename = writer.filename
+        self.filesize = filesize
+        self.received = 0
+        self.max_output = max_output
+        self.block_size = block_size
+        self.decompressor = COMPRESSORS[compression][1]()
+        self.failure = None
+    
+    @property
+    def remaining(self):
+        return self.filesize - self.received
+    
+    @property
+    def sha256(self):
+        return self.writer.sha256
+    
+    @property
+    def error(self):
+        if self.failure is None and not self.remaining and not self.decompressor.eof:
+            return f"Flux {self.compression} incomplet"
+        return self.failure
+    
+    def _output(self, data):
+        if self.writer.received + len(data) > self.max_output:
+            raise ValueError(f"Fichier trop volumineux une fois décompressé (maximum {self.max_output} octets)")
+        self.writer.write(data)
+    
+    def write(self, data):
+        self.received += len(data)
+        if self.failure:
+            return
+        decompressor = self.decompressor
+        try:
+            if hasattr(decompressor, 'unconsumed_tail'):
+                # zlib: le reste non traité est conservé dans unconsumed_tail
+                self._output(decompressor.decompress(bytes(data), self.block_size))
+                while decompressor.unconsumed_tail:
+                    self._output(decompressor.decompress(decompressor.unconsumed_tail, self.block_size))
+            else:
+                # lzma/bz2: le reste est gardé en interne jusqu'à needs_input
+                self._output(decompressor.decompress(bytes(data), self.block_size))
+                while not decompressor.needs_input and not decompressor.eof:
+                    self._output(decompressor.decompress(b'', self.block_size))
+        except (zlib.error, lzma.LZMAError, OSError, EOFError) as e:
+            self.failure = f"Données {self.compression} invalides ({e})"
+        except ValueError as e:
+            self.failure = str(e)
+    
+    def commit(self):
+        # Taille réelle, connue seulement après décompression
+        self.writer.filesize = self.writer.received
+        return self.writer.commit()
+    
+    def abort(self):
+        self.writer.abort()
+
+class UploadWriter:
+    """Écrit un UPLOAD en flux dans un fichier temporaire, renommé atomiquement à la fin"""
+    
+    def __init__(self, files_dir, filename, filesize):
+        self.filename = filename
+        self.filesize = filesize
+        self.received = 0
+        self.path = os.path.join(files_dir, filename)
+        fd, self.temp_path = tempfile.mkstemp(prefix='.upload-', dir=files_dir)
+        self.file = os.fdopen(fd, 'wb')
+        self.digest = hashlib.sha256()
+        self.sha256 = None
+    
+    @property
+    def remaining(self):
+        return self.filesize - self.received
+    
+    def write(self, data):
+        self.file.write(data)
+        self.digest.update(data)
+        self.received += len(data)
+    
+    def commit(self):
+        """Remplace atomiquement le fichier de destination"""
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+        self.sha256 = self.digest.hexdigest()
+        return f"Fichier {self.filename} uploadé avec succès"
+    
+    def abort(self):
+        self.file.close()
+        os.unlink(self.temp_path)
+
+class TokenBucket:
+    """Seau à jetons: rate jetons par seconde, au plus burst en réserve
+    
+    reserve() prélève les jetons quitte à s'endetter et retourne l'attente
+    nécessaire avant de les utiliser: l'appelant patiente (time.sleep ou
+    asyncio.sleep) au lieu d'être refusé. Un débit nul ou négatif = illimité.
+    """
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def reserve(self, amount=1):
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+    
+    def take(self, amount=1):
+        """Prélève les jetons s'ils sont disponibles; sinon False, sans s'endetter"""
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+class BandwidthShaper:
+    """Limite de débit des transferts de fichiers: un seau par utilisateur et un seau global
+    
+    Les transferts avancent par tranches de quantum octets. Chaque tranche est
+    réservée dans le seau de l'utilisateur puis dans le seau global, qui sert les
+    réservations dans leur ordre d'arrivée: les transferts simultanés alternent
+    tranche par tranche au lieu que le premier occupe toute la liaison. Les
+    messages de contrôle (CHAT, LIST, réponses) ne passent pas par ici et ne
+    patientent jamais derrière des octets de fichiers.
+    """
+    
+    def __init__(self, user_rate, global_rate, quantum=64 * 1024):
+        self.quantum = quantum
+        self.lock = threading.Lock()
+        self.waited = 0.0  # Secondes d'attente cumulées, pour /metrics
+        self.configure(user_rate, global_rate)
+    
+    def _bucket(self, rate):
+        # Réserve d'un dixième de seconde: un nouveau transfert ne part pas en rafale
+        return TokenBucket(rate, max(self.quantum, rate // 10))
+    
+    def configure(self, user_rate=None, global_rate=None):
+        """Change les limites à chaud (None: inchangée); les transferts en cours en tiennent compte à la tranche suivante"""
+        with self.lock:
+            if user_rate is not None:
+                self.user_rate = user_rate
+                self.user_buckets = {}
+            if global_rate is not None:
+                self.global_rate = global_rate
+                self.global_bucket = self._bucket(global_rate)
+    
+    def limits(self):
+        return {'user_rate': self.user_rate, 'global_rate': self.global_rate}
+    
+    def slices(self, offset, length):
+        """Découpe un segment en tranches; d'un seul tenant si aucune limite n'est active"""
+        if self.user_rate <= 0 and self.global_rate <= 0:
+            yield offset, length
+            return
+        end = offset + length
+        while offset < end:
+            size = min(self.quantum, end - offset)
+            yield offset, size
+            offset += size
+    
+    def _delays(self, username, amount):
+        # Le seau global n'est réservé qu'après l'attente propre à l'utilisateur
+        if username is not None and self.user_rate > 0:
+            with self.lock:
+                bucket = self.user_buckets.get(username)
+                if bucket is None:
+                    bucket = self.user_buckets[username] = self._bucket(self.user_rate)
+            yield bucket.reserve(amount)
+        yield self.global_bucket.reserve(amount)
+    
+    def wait(self, username, amount):
+        for delay in self._delays(username, amount):
+            if delay:
+                self.waited += delay
+                time.sleep(delay)
+    
+    async def wait_async(self, username, amount):
+        for delay in self._delays(username, amount):
+            if delay:
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+def set_receive_timeout(sock, seconds):
+    """Délai de réception noyau (SO_RCVTIMEO): recv() lève BlockingIOError à l'échéance
+    
+    Contrairement à settimeout(), la socket reste bloquante pour Python: les
+    envois MSG_DONTWAIT du Broadcaster ne se mettent pas à attendre.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, struct.pack('ll', int(seconds), 0))
+    return seconds
+
+def set_keepalive(sock, idle=60, interval=10, count=5):
+    """Sondes TCP: une connexion à moitié ouverte (client disparu) finit en erreur au lieu de rester pendue"""
+    if sock is None:
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+
+class ConnectionGuard:
+    """Contrôle d'admission par adresse IP: bannissements, connexions simultanées, débit de commandes
+    
+    banned.json associe une adresse à {"until": timestamp ou null, "reason": ...};
+    il est relu quand il change et consulté en O(1) à chaque accept(). Les
+    commandes au-delà du débit sont ralenties (pace), pas refusées: un lot tramé
+    reste valide. Seules les tentatives d'authentification sont refusées, et une
+    adresse qui en enchaîne ban_after refusées est bannie ban_duration secondes.
+    Une limite à 0 est désactivée.
+    """
+    
+    REFUSALS = {
+        'banned': "Adresse bannie",
+        'per_ip': "Trop de connexions depuis cette adresse",
+        'global': "Serveur saturé, réessayez plus tard",
+    }
+    # Commandes d'authentification: quota séparé, plus strict (force brute)
+    AUTH_COMMANDS = ('REGISTER', 'LOGIN', 'RESUME')
+    # Commandes suivies de données: les refuser désynchroniserait le flux, leur débit relève de BandwidthShaper
+    DATA_COMMANDS = ('UPLOAD', 'UPLOAD_CHUNK')
+    
+    def __init__(self, banned_file, max_connections, max_per_ip, command_rate, command_burst,
+                 auth_rate, auth_burst, ban_after, ban_duration, check_interval=5):
+        self.banned_file = banned_file
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.command_rate, self.command_burst = command_rate, command_burst
+        self.auth_rate, self.auth_burst = auth_rate, auth_burst
+        self.ban_after = ban_after
+        self.ban_duration = ban_duration
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.connections = collections.Counter()  # ip -> connexions ouvertes
+        self.total = 0
+        self.clients = {}  # ip -> [seau des commandes, seau d'authentification, refus consécutifs, dernier usage]
+        self.banned = {}
+        self.banned_mtime = None
+        self.next_check = 0
+        self._load()
+    
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.banned_file)
+            if mtime == self.banned_mtime:
+                return
+            with open(self.banned_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"[Bannissements] {self.banned_file} illisible: {e}")
+            return
+        # Une simple liste d'adresses est aussi acceptée (bannissement permanent)
+        if isinstance(entries, list):
+            entries = {address: {} for address in entries}
+        self.banned = {address: entry if isinstance(entry, dict) else {} for address, entry in entries.items()}
+        self.banned_mtime = mtime
+    
+    def _save(self):
+        temp_path = self.banned_file + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.banned, f, indent=2)
+        os.replace(temp_path, self.banned_file)
+        self.banned_mtime = os.path.getmtime(self.banned_file)
+    
+    def _maintain(self, now):
+        """Relit banned.json s'il a changé, retire les bannissements expirés et oublie les adresses inactives depuis 10 minutes"""
+        self.next_check = now + self.check_interval
+        self._load()
+        current = time.time()
+        expired = [address for address, entry in self.banned.items()
+                   if entry.get('until') is not None and entry['until'] <= current]
+        if expired:
+            for address in expired:
+                del self.banned[address]
+            try:
+                self._save()
+            except OSError as e:
+                print(f"[Bannissements] Écriture de {self.banned_file} impossible: {e}")
+        for address in [address for address, state in self.clients.items()
+                        if now - state[3] > 600 and not self.connections[address]]:
+            del self.clients[address]
+    
+    def is_banned(self, address):
+        entry = self.banned.get(address)
+        if entry is None:
+            return False
+        until = entry.get('until')
+        return until is None or until > time.time()
+    
+    def ban(self, address, duration, reason):
+        with self.lock:
+            self.banned[address] = {'until': time.time() + duration, 'reason': reason}
+            try:
+                self._save()
+            except OSError as e:
+                print(f"[Bannissements] Écriture de {self.banned_file} impossible: {e}")
+        print(f"[Bannissements] {address} banni {duration}s: {reason}")
+    
+    def admit(self, address, per_ip=True):
+        """Compte une nouvelle connexion; retourne le motif du refus (clé de REFUSALS) ou None
+        
+        per_ip=False pour un proxy, dont l'adresse est partagée par tous ses clients.
+        """
+        if self.is_banned(address):
+            return 'banned'
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.next_check:
+                self._maintain(now)
+            if self.max_connections > 0 and self.total >= self.max_connections:
+                return 'global'
+            if per_ip and self.max_per_ip > 0 and self.connections[address] >= self.max_per_ip:
+                return 'per_ip'
+            self.connections[address] += 1
+            self.total += 1
+        return None
+    
+    def release(self, address):
+        with self.lock:
+            self.total -= 1
+            self.connections[address] -= 1
+            if self.connections[address] <= 0:
+                del self.connections[address]
+    
+    def _client(self, address):
+        """État de l'adresse, créé au premier usage (verrou tenu)"""
+        state = self.clients.get(address)
+        if state is None:
+            state = self.clients[address] = [TokenBucket(self.command_rate, self.command_burst),
+                                             TokenBucket(self.auth_rate, self.auth_burst), 0, 0]
+        state[3] = time.monotonic()
+        return state
+    
+    def pace(self, address, command):
+        """Attente à observer avant de lire la suite des commandes de l'adresse (0 sous le débit)"""
+        if command in self.DATA_COMMANDS:
+            return 0
+        with self.lock:
+            return self._client(address)[0].reserve()
+    
+    def check_command(self, address, command):
+        """None si la commande est admise, 'throttled' si le quota d'authentification est dépassé, 'banned' si l'adresse vient d'être bannie"""
+        if command not in self.AUTH_COMMANDS:
+            return None
+        with self.lock:
+            state = self._client(address)
+            allowed = state[1].take()
+            if allowed:
+                state[2] = 0
+                return None
+            state[2] += 1
+            strikes = state[2]
+        if self.ban_after > 0 and strikes >= self.ban_after:
+            self.ban(address, self.ban_duration, f"{strikes} commandes refusées d'affilée")
+            return 'banned'
+        return 'throttled'
+
+class CredentialCache:
+    """Cache court des identifiants déjà vérifiés, pour absorber les reconnexions en rafale
+    
+    Les clés sont des empreintes HMAC (clé aléatoire propre au processus) du nom,
+    de l'empreinte stockée et du mot de passe: un changement d'empreinte invalide
+    l'entrée, et le cache ne contient aucun mot de passe réutilisable.
+    """
+    
+    def __init__(self, ttl=300, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.secret = os.urandom(32)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+    
+    def _key(self, username, stored, password):
+        return hmac.new(self.secret, f"{username}\0{stored}\0{password}".encode(), 'sha256').digest()
+    
+    def check(self, username, stored, password):
+        key = self._key(username, stored, password)
+        with self.lock:
+            expires_at = self.entries.get(key)
+            if expires_at is None:
+                return False
+            if expires_at < time.time():
+                del self.entries[key]
+                return False
+            return True
+    
+    def add(self, username, stored, password):
+        key = self._key(username, stored, password)
+        with self.lock:
+            self.entries[key] = time.time() + self.ttl
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class SessionTable:
+    """Jetons de session en mémoire: jeton -> utilisateur, avec expiration glissante
+    
+    Plusieurs jetons par utilisateur (un par appareil), au plus max_per_user:
+    le plus ancien est révoqué au-delà. Les jetons expirés sont purgés et la
+    table est sauvegardée dans sessions.json par un thread périodique.
+    """
+    
+    def __init__(self, sessions_file, ttl, max_per_user=10, save_interval=30):
+        self.sessions_file = sessions_file
+        self.ttl = ttl
+        self.max_per_user = max_per_user
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.by_user = collections.defaultdict(collections.OrderedDict)
+        self.dirty = False
+        self.listener = None  # Appelé à chaque création, prolongation ou révocation (relais entre workers)
+        self._load()
+    
+    def _load(self):
+        try:
+            with open(self.sessions_file, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for token, entry in saved.items():
+            # Ancien format (jeton -> nom d'utilisateur, sans date d'expiration): considéré
+            # comme expiré, ces jetons ont pu être diffusés; la prochaine sauvegarde les efface
+            if not isinstance(entry, dict):
+                self.dirty = True
+                continue
+            if entry['expires_at'] > now:
+                self.tokens[token] = entry
+                self.by_user[entry['user']][token] = None
+    
+    def start(self):
+        threading.Thread(target=self._maintenance_loop, daemon=True).start()
+    
+    def create(self, username):
+        token = uuid.uuid4().hex
+        entry = {'user': username, 'expires_at': time.time() + self.ttl}
+        with self.lock:
+            self._add(token, entry)
+        if self.listener:
+            self.listener('set', token, dict(entry))
+        return token
+    
+    def _add(self, token, entry):
+        self.tokens[token] = entry
+        user_tokens = self.by_user[entry['user']]
+        user_tokens[token] = None
+        while len(user_tokens) > self.max_per_user:
+            oldest, _ = user_tokens.popitem(last=False)
+            self.tokens.pop(oldest, None)
+        self.dirty = True
+    
+    def apply(self, action, token, entry):
+        """Applique un changement venu d'un autre processus, sans le relayer"""
+        with self.lock:
+            if action == 'drop':
+                self._remove(token)
+            elif token in self.tokens:
+                self.tokens[token]['expires_at'] = max(self.tokens[token]['expires_at'], entry['expires_at'])
+                self.dirty = True
+            else:
+                self._add(token, dict(entry))
+    
+    def resume(self, token):
+        """Utilisateur d'un jeton valide (prolongé), ou None"""
+        with self.lock:
+            entry = self.tokens.get(token)
+            if entry is None:
+                return None
+            if entry['expires_at'] < time.time():
+                self._remove(token)
+                return None
+            entry['expires_at'] = time.time() + self.ttl
+            self.dirty = True
+            entry = dict(entry)
+        if self.listener:
+            self.listener('set', token, entry)
+        return entry['user']
+    
+    def revoke(self, token):
+        with self.lock:
+            self._remove(token)
+        if self.listener:
+            self.listener('drop', token, None)
+    
+    def _remove(self, token):
+        entry = self.tokens.pop(token, None)
+        if entry is not None:
+            user_tokens = self.by_user.get(entry['user'])
+            if user_tokens is not None:
+                user_tokens.pop(token, None)
+                if not user_tokens:
+                    del self.by_user[entry['user']]
+            self.dirty = True
+    
+    def purge(self):
+        now = time.time()
+        with self.lock:
+            for token in [token for token, entry in self.tokens.items() if entry['expires_at'] < now]:
+                self._remove(token)
+    
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            snapshot = {token: dict(entry) for token, entry in self.tokens.items()}
+            self.dirty = False
+        directory = os.path.dirname(os.path.abspath(self.sessions_file))
+        fd, temp_path = tempfile.mkstemp(prefix='.sessions-', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, self.sessions_file)
+    
+    def _maintenance_loop(self):
+        while True:
+            time.sleep(self.save_interval)
+            self.purge()
+            self.save()
+
+class JournalAccountStore:
+    """Comptes en mémoire, persistés par un journal append-only et compactés périodiquement
+    
+    accounts.json reste l'instantané complet (même format qu'avant); chaque
+    modification est une ligne JSON ajoutée à accounts.json.journal. Un thread
+    regroupe les fsync: plusieurs inscriptions simultanées partagent la même
+    synchronisation disque. Au-delà de compact_threshold lignes, le journal est
+    fusionné dans un nouvel instantané écrit à côté puis renommé.
+    """
+    
+    def __init__(self, accounts_file, compact_threshold=1000, fsync_interval=0.01):
+        self.accounts_file = accounts_file
+        self.journal_file = accounts_file + '.journal'
+        self.compact_threshold = compact_threshold
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.synced = threading.Condition(self.lock)
+        self.accounts = self._load()
+        self.journal = open(self.journal_file, 'a', encoding='utf-8')
+        self.journal_entries = 0
+        self.written_seq = 0
+        self.synced_seq = 0
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+    
+    def _load(self):
+        accounts = {}
+        if os.path.exists(self.accounts_file):
+            try:
+                with open(self.accounts_file, 'r') as f:
+                    accounts = json.load(f)
+            except ValueError:
+                accounts = {}
+        # Rejouer le journal d'une compaction interrompue, puis le journal courant
+        for path in (self.journal_file + '.old', self.journal_file):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Dernière ligne incomplète après un arrêt brutal
+                    accounts[entry['user']] = entry['record']
+        return accounts
+    
+    def __contains__(self, username):
+        return username in self.accounts
+    
+    def __len__(self):
+        return len(self.accounts)
+    
+    def get(self, username):
+        return self.accounts.get(username)
+    
+    def _write(self, username, record):
+        """Ajoute une modification au journal puis attend sa synchronisation (verrou tenu)"""
+        self.accounts[username] = record
+        self.journal.write(json.dumps({'user': username, 'record': record}) + '\n')
+        self.journal_entries += 1
+        self.written_seq += 1
+        seq = self.written_seq
+        self.synced.notify_all()
+        while self.synced_seq < seq:
+            self.synced.wait()
+    
+    def add(self, username, record):
+        """Crée un compte; False si le nom existe déjà"""
+        with self.lock:
+            if username in self.accounts:
+                return False
+            self._write(username, record)
+            return True
+    
+    def update(self, username, record):
+        with self.lock:
+            self._write(username, record)
+    
+    def _flush_loop(self):
+        while True:
+            with self.lock:
+                while self.synced_seq == self.written_seq:
+                    self.synced.wait()
+            # Laisser les écritures concurrentes rejoindre ce lot
+            time.sleep(self.fsync_interval)
+            with self.lock:
+                seq = self.written_seq
+                self.journal.flush()
+                fd = self.journal.fileno()
+            os.fsync(fd)
+            with self.lock:
+                self.synced_seq = seq
+                self.synced.notify_all()
+                if self.journal_entries >= self.compact_threshold:
+                    snapshot = dict(self.accounts)
+                    self.journal.close()
+                    os.replace(self.journal_file, self.journal_file + '.old')
+                    self.journal = open(self.journal_file, 'a', encoding='utf-8')
+                    self.journal_entries = 0
+                else:
+                    snapshot = None
+            if snapshot is not None:
+                self._compact(snapshot)
+    
+    def _compact(self, snapshot):
+        """Écrit un nouvel instantané, puis supprime le journal qu'il intègre"""
+        directory = os.path.dirname(os.path.abspath(self.accounts_file))
+        fd, temp_path = tempfile.mkstemp(prefix='.accounts-', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.accounts_file)
+        os.unlink(self.journal_file + '.old')
+
+class SqliteAccountStore:
+    """Comptes dans une base sqlite embarquée (mode WAL), importés de accounts.json au premier démarrage"""
+    
+    def __init__(self, database_file, accounts_file=None):
+        is_new = not os.path.exists(database_file)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(database_file, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS accounts (username TEXT PRIMARY KEY, record TEXT NOT NULL)')
+        if is_new and accounts_file and os.path.exists(accounts_file):
+            with open(accounts_file, 'r') as f:
+                accounts = json.load(f)
+            with self.db:
+                self.db.executemany('INSERT OR IGNORE INTO accounts VALUES (?, ?)',
+                                    [(username, json.dumps(record)) for username, record in accounts.items()])
+        self.db.commit()
+    
+    def __contains__(self, username):
+        return self.get(username) is not None
+    
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM accounts').fetchone()[0]
+    
+    def get(self, username):
+        with self.lock:
+            row = self.db.execute('SELECT record FROM accounts WHERE username = ?', (username,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def add(self, username, record):
+        with self.lock, self.db:
+            cursor = self.db.execute('INSERT OR IGNORE INTO accounts VALUES (?, ?)', (username, json.dumps(record)))
+            return cursor.rowcount == 1
+    
+    def update(self, username, record):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO accounts VALUES (?, ?)', (username, json.dumps(record)))
+
+class ChatHistory:
+    """Historique du chat: tampon circulaire en mémoire adossé à un journal append-only
+    
+    Chaque message est une ligne JSON {id, user, text, timestamp} ajoutée au
+    journal; seuls les derniers messages sont gardés en mémoire. Un index
+    clairsemé (une entrée "timestamp position" tous les index_interval octets,
+    dans <journal>.idx) permet de retrouver une date par recherche dichotomique
+    puis lecture séquentielle d'un seul segment du journal.
+    """
+    
+    def __init__(self, log_file, size, legacy_file=None, index_interval=64 * 1024, replica=False):
+        self.log_file = log_file
+        self.index_file = log_file + '.idx'
+        self.index_interval = index_interval
+        self.records = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+        # Copie en lecture seule (workers): un autre processus écrit le journal et l'index
+        self.replica = replica
+        if not replica and not os.path.exists(log_file) and legacy_file and os.path.exists(legacy_file):
+            self._import_legacy(legacy_file)
+        self.records.extend(self._read_tail(size))
+        self.last_id = self.records[-1]['id'] if self.records else 0
+        if replica:
+            self.log = self.index = None
+            self.index_times, self.index_offsets = [], []
+            self.index_read = 0
+            return
+        self.log = open(log_file, 'ab')
+        self._load_index()
+        self.index = open(self.index_file, 'a', encoding='utf-8')
+    
+    def _import_legacy(self, legacy_file):
+        try:
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                messages = json.load(f)
+        except (OSError, ValueError):
+            return
+        with open(self.log_file, 'w', encoding='utf-8') as log:
+            for message_id, message in enumerate(messages, 1):
+                record = {'id': message_id, 'user': message['user'], 'text': message['text'],
+                          'timestamp': message['timestamp']}
+                log.write(json.dumps(record) + '\n')
+    
+    def _load_index(self):
+        """Charge l'index clairsemé, ou le reconstruit en une passe s'il manque ou est incohérent"""
+        self.index_times = []
+        self.index_offsets = []
+        log_size = self.log.tell()
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    timestamp, offset = line.split()
+                    self.index_times.append(float(timestamp))
+                    self.index_offsets.append(int(offset))
+        except (OSError, ValueError):
+            self.index_times, self.index_offsets = [], []
+        
+        if log_size and (not self.index_offsets or self.index_offsets[-1] >= log_size):
+            self.index_times, self.index_offsets = [], []
+            with open(self.log_file, 'rb') as f:
+                offset = 0
+                for line in f:
+                    if not self.index_offsets or offset - self.index_offsets[-1] >= self.index_interval:
+                        try:
+                            self.index_times.append(json.loads(line)['timestamp'])
+                            self.index_offsets.append(offset)
+                        except (ValueError, KeyError):
+                            pass
+                    offset += len(line)
+            with open(self.index_file, 'w', encoding='utf-8') as f:
+                for timestamp, offset in zip(self.index_times, self.index_offsets):
+                    f.write(f"{timestamp!r} {offset}\n")
+    
+    def _read_tail(self, count, block_size=65536):
+        """Lit les count dernières lignes du journal en partant de la fin"""
+        if count <= 0 or not os.path.exists(self.log_file):
+            return []
+        with open(self.log_file, 'rb') as f:
+            position = f.seek(0, os.SEEK_END)
+            data = b''
+            while position > 0 and data.count(b'\n') <= count:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+        records = []
+        for line in data.splitlines()[-count:]:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue  # Ligne tronquée (début de bloc ou arrêt brutal)
+        return records
+    
+    def append(self, user, text, timestamp=None):
+        """Ajoute un message et retourne son enregistrement"""
+        with self.lock:
+            self.last_id += 1
+            record = {'id': self.last_id, 'user': user, 'text': text,
+                      'timestamp': time.time() if timestamp is None else timestamp}
+            offset = self.log.tell()
+            self.log.write((json.dumps(record) + '\n').encode('utf-8'))
+            self.log.flush()
+            if not self.index_offsets or offset - self.index_offsets[-1] >= self.index_interval:
+                self.index_times.append(record['timestamp'])
+                self.index_offsets.append(offset)
+                self.index.write(f"{record['timestamp']!r} {offset}\n")
+                self.index.flush()
+            self.records.append(record)
+        return record
+    
+    def add_replica(self, record):
+        """Ajoute au tampon un message déjà écrit dans le journal par un autre processus"""
+        with self.lock:
+            if record['id'] > self.last_id:
+                self.records.append(record)
+                self.last_id = record['id']
+    
+    def _refresh_index(self):
+        """Copie: lit les points d'index ajoutés depuis la dernière fois par le processus écrivain"""
+        try:
+            with open(self.index_file, 'rb') as f:
+                f.seek(self.index_read)
+                data = f.read()
+        except OSError:
+            return
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                timestamp, offset = line.split()
+                self.index_times.append(float(timestamp))
+                self.index_offsets.append(int(offset))
+            except ValueError:
+                continue
+        self.index_read += end
+    
+    def sync(self):
+        """Force l'écriture sur disque du journal et de son index"""
+        if self.replica:
+            return
+        with self.lock:
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.index.flush()
+    
+    def recent(self, count):
+        """Les count derniers messages, du plus ancien au plus récent"""
+        with self.lock:
+            if count <= 0:
+                return []
+            return list(self.records)[-count:]
+    
+    def after(self, message_id, limit=100):
+        """Messages encore en mémoire d'identifiant supérieur à message_id, au plus limit"""
+        with self.lock:
+            if not self.records or message_id >= self.last_id:
+                return []
+            # Identifiants consécutifs: position directe dans le tampon
+            start = max(0, len(self.records) - (self.last_id - message_id))
+            return list(itertools.islice(self.records, start, start + limit))
+    
+    def _scan(self, f, start, end=None):
+        """Messages du journal entre les positions start et end"""
+        f.seek(start)
+        position = start
+        for line in f:
+            if end is not None and position >= end:
+                break
+            position += len(line)
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+    
+    def query(self, since=None, before=None, limit=50):
+        """Messages postérieurs à since et/ou antérieurs à before, au plus limit
+        
+        Avec since, ce sont les premiers messages après cette date (pagination
+        vers l'avant); sinon les derniers avant before (remontée dans l'historique).
+        """
+        with self.lock:
+            if self.replica:
+                self._refresh_index()
+            else:
+                self.log.flush()
+            times = list(self.index_times)
+            offsets = list(self.index_offsets)
+        if not offsets or limit <= 0:
+            return []
+        
+        with open(self.log_file, 'rb') as f:
+            if since is not None:
+                # Dernier point d'index strictement avant since
+                start = offsets[max(0, bisect.bisect_left(times, since) - 1)]
+                results = []
+                for record in self._scan(f, start):
+                    if record['timestamp'] <= since:
+                        continue
+                    if (before is not None and record['timestamp'] >= before) or len(results) >= limit:
+                        break
+                    results.append(record)
+                return results
+            
+            # Remonter segment par segment depuis le premier point d'index après before
+            segment = len(times) if before is None else bisect.bisect_left(times, before)
+            end = offsets[segment] if segment < len(offsets) else None
+            results = []
+            while segment > 0 and len(results) < limit:
+                segment -= 1
+                chunk = [record for record in self._scan(f, offsets[segment], end)
+                         if before is None or record['timestamp'] < before]
+                results = chunk + results
+                end = offsets[segment]
+            return results[-limit:]
+
+class FlatStorage:
+    """Stockage d'origine: un fichier par nom dans le répertoire partagé"""
+    
+    def __init__(self, files_dir):
+        self.files_dir = files_dir
+    
+    def path(self, filename):
+        return os.path.join(self.files_dir, filename)
+    
+    def writer(self, filename, filesize):
+        return UploadWriter(self.files_dir, filename, filesize)
+    
+    def ingest(self, filename, path):
+        """Adopte un fichier complet déjà écrit sur le même disque; retourne son SHA-256 s'il est connu"""
+        os.replace(path, self.path(filename))
+        return None
+    
+    def stat(self, filename):
+        """Taille, date de modification et SHA-256 (si connu) du fichier, ou None"""
+        try:
+            info = os.stat(self.path(filename))
+        except OSError:
+            return None
+        return {'size': info.st_size, 'mtime': info.st_mtime, 'sha256': None}
+    
+    def size(self, filename):
+        """Taille du fichier, ou None s'il n'existe pas"""
+        path = self.path(filename)
+        return os.path.getsize(path) if os.path.isfile(path) else None
+    
+    def segments(self, filename, offset, length):
+        """Morceaux de fichiers disque (chemin, début, longueur) couvrant la plage demandée"""
+        return [(self.path(filename), offset, length)] if length else []
+    
+    def link(self, filename, sha256):
+        # Pas d'index de contenu: le fichier doit être envoyé
+        return False
+    
+    def list(self):
+        # Les fichiers cachés sont des transferts en cours
+        return [name for name in os.listdir(self.files_dir) if not name.startswith('.')]
+
+class ContentStore:
+    """Stockage dédupliqué: blocs adressés par leur SHA-256, noms associés à des manifestes
+    
+    - objects/ab/<sha256>: contenu d'un bloc, stocké une seule fois
+    - files/<sha256>.json: liste des blocs d'un fichier complet
+    - names/<filename>: empreinte et taille du fichier publié sous ce nom
+    """
+    
+    def __init__(self, root, chunk_size):
+        self.root = root
+        self.chunk_size = chunk_size
+        for directory in ('objects', 'files', 'names'):
+            os.makedirs(os.path.join(root, directory), exist_ok=True)
+    
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+    
+    def writer(self, filename, filesize):
+        return ContentWriter(self, filename, filesize)
+    
+    def ingest(self, filename, path):
+        """Découpe et déduplique un fichier complet, puis le supprime"""
+        writer = ContentWriter(self, filename, os.path.getsize(path))
+        with open(path, 'rb') as f:
+            while writer.remaining:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                writer.write(data)
+        writer.commit()
+        os.unlink(path)
+        return writer.sha256
+    
+    def put_object(self, temp_path, digest):
+        """Range un bloc écrit dans un fichier temporaire, sauf s'il est déjà connu"""
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            os.unlink(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return digest
+    
+    def _write_json(self, path, data):
+        fd, temp_path = tempfile.mkstemp(prefix='.manifest-', dir=self.root)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    
+    def put_manifest(self, filename, digest, filesize, chunks):
+        manifest_path = os.path.join(self.root, 'files', digest + '.json')
+        if not os.path.exists(manifest_path):
+            self._write_json(manifest_path, {'size': filesize, 'chunks': chunks})
+        self._write_json(os.path.join(self.root, 'names', filename), {'sha256': digest, 'size': filesize})
+    
+    def _manifest(self, filename):
+        try:
+            with open(os.path.join(self.root, 'names', filename), 'r') as f:
+                entry = json.load(f)
+            with open(os.path.join(self.root, 'files', entry['sha256'] + '.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError, KeyError):
+            return None
+    
+    def stat(self, filename):
+        path = os.path.join(self.root, 'names', filename)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+            return {'size': entry['size'], 'mtime': os.stat(path).st_mtime, 'sha256': entry['sha256']}
+        except (OSError, ValueError, KeyError):
+            return None
+    
+    def size(self, filename):
+        manifest = self._manifest(filename)
+        return manifest['size'] if manifest else None
+    
+    def segments(self, filename, offset, length):
+        segments = []
+        position = 0
+        end = offset + length
+        for digest, size in self._manifest(filename)['chunks']:
+            if position + size > offset and position < end:
+                start = max(offset, position) - position
+                segments.append((self.object_path(digest), start, min(end, position + size) - position - start))
+            position += size
+        return segments
+    
+    def link(self, filename, sha256):
+        """Publie un contenu déjà stocké sous un nouveau nom, sans transfert"""
+        manifest_path = os.path.join(self.root, 'files', sha256 + '.json')
+        if len(sha256) != 64 or not os.path.exists(manifest_path):
+            return False
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        self._write_json(os.path.join(self.root, 'names', filename), {'sha256': sha256, 'size': manifest['size']})
+        return True
+    
+    def list(self):
+        return os.listdir(os.path.join(self.root, 'names'))
+
+class ContentWriter:
+    """Découpe un UPLOAD en blocs hachés au fil de l'eau pour le ContentStore"""
+    
+    def __init__(self, store, filename, filesize):
+        self.store = store
+        self.filename = filename
+        self.filesize = filesize
+        self.received = 0
+        self.digest = hashlib.sha256()
+        self.chunks = []
+        self._open_chunk()
+    
+    @property
+    def remaining(self):
+        return self.filesize - self.received
+    
+    def _open_chunk(self):
+        fd, self.chunk_path = tempfile.mkstemp(prefix='.chunk-', dir=self.store.root)
+        self.chunk_file = os.fdopen(fd, 'wb')
+        self.chunk_digest = hashlib.sha256()
+        self.chunk_received = 0
+    
+    def _close_chunk(self):
+        self.chunk_file.close()
+        if self.chunk_received:
+            digest = self.store.put_object(self.chunk_path, self.chunk_digest.hexdigest())
+            self.chunks.append([digest, self.chunk_received])
+        else:
+            os.unlink(self.chunk_path)
+    
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            part = view[:self.store.chunk_size - self.chunk_received]
+            self.chunk_file.write(part)
+            self.chunk_digest.update(part)
+            self.digest.update(part)
+            self.chunk_received += len(part)
+            self.received += len(part)
+            view = view[len(part):]
+            if self.chunk_received == self.store.chunk_size:
+                self._close_chunk()
+                self._open_chunk()
+    
+    def commit(self):
+        self._close_chunk()
+        self.sha256 = self.digest.hexdigest()
+        self.store.put_manifest(self.filename, self.sha256, self.filesize, self.chunks)
+        return f"Fichier {self.filename} uploadé avec succès"
+    
+    def abort(self):
+        # Les blocs déjà rangés restent disponibles pour la déduplication
+        self.chunk_file.close()
+        os.unlink(self.chunk_path)
+
+class ChunkedUpload:
+    """Transfert découpé en blocs, reprenable et parallélisable sur plusieurs connexions
+    
+    Sur disque: <id>.json (description), <id>.part (données, écrites à la position
+    de chaque bloc) et <id>.chunks (journal des blocs reçus, un index par ligne).
+    """
+    
+    def __init__(self, directory, upload_id, meta, received):
+        self.directory = directory
+        self.upload_id = upload_id
+        self.filename = meta['filename']
+        self.filesize = meta['filesize']
+        self.chunk_size = meta['chunk_size']
+        self.owner = meta['owner']
+        self.created_at = meta['created_at']
+        self.received = received
+        self.lock = threading.Lock()
+    
+    def _path(self, suffix):
+        return os.path.join(self.directory, self.upload_id + suffix)
+    
+    @classmethod
+    def create(cls, directory, filename, filesize, chunk_size, owner):
+        upload_id = uuid.uuid4().hex
+        meta = {
+            'filename': filename,
+            'filesize': filesize,
+            'chunk_size': chunk_size,
+            'owner': owner,
+            'created_at': time.time()
+        }
+        upload = cls(directory, upload_id, meta, set())
+        # Fichier de données préalloué (creux) pour les écritures positionnées
+        with open(upload._path('.part'), 'wb') as f:
+            f.truncate(filesize)
+        open(upload._path('.chunks'), 'w').close()
+        with open(upload._path('.json'), 'w') as f:
+            json.dump(meta, f)
+        return upload
+    
+    @classmethod
+    def load(cls, directory, upload_id):
+        with open(os.path.join(directory, upload_id + '.json'), 'r') as f:
+            meta = json.load(f)
+        received = set()
+        with open(os.path.join(directory, upload_id + '.chunks'), 'r') as f:
+            for line in f:
+                if line.strip():
+                    received.add(int(line))
+        return cls(directory, upload_id, meta, received)
+    
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.filesize // self.chunk_size))
+    
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.filesize - index * self.chunk_size)
+    
+    def refresh(self):
+        """Relit le journal des blocs (écrit aussi par les autres workers); False si le transfert a disparu"""
+        try:
+            with open(self._path('.chunks'), 'r') as f:
+                received = {int(line) for line in f if line.strip()}
+        except (OSError, ValueError):
+            return False
+        with self.lock:
+            self.received |= received
+        return True
+    
+    def missing_chunks(self):
+        return [index for index in range(self.chunk_count) if index not in self.received]
+    
+    def mark_received(self, index):
+        """Enregistre un bloc complet dans le journal"""
+        with self.lock:
+            if index in self.received:
+                return
+            with open(self._path('.chunks'), 'a') as f:
+                f.write(f"{index}\n")
+            self.received.add(index)
+    
+    def commit(self, storage):
+        """Place le fichier assemblé dans le stockage partagé; retourne son SHA-256 s'il est connu"""
+        sha256 = storage.ingest(self.filename, self._path('.part'))
+        self.discard()
+        return sha256
+    
+    def discard(self):
+        for suffix in ('.part', '.chunks', '.json'):
+            try:
+                os.unlink(self._path(suffix))
+            except FileNotFoundError:
+                pass
+
+class ChunkWriter:
+    """Écrit un bloc d'un ChunkedUpload à sa position dans le fichier de données"""
+    
+    def __init__(self, upload, index):
+        self.upload = upload
+        self.index = index
+        self.filename = upload.filename
+        self.filesize = upload.chunk_length(index)
+        self.received = 0
+        self.offset = index * upload.chunk_size
+        self.fd = os.open(upload._path('.part'), os.O_WRONLY)
+    
+    @property
+    def remaining(self):
+        return self.filesize - self.received
+    
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, self.offset + self.received)
+            self.received += written
+            view = view[written:]
+    
+    def commit(self):
+        os.close(self.fd)
+        self.upload.mark_received(self.index)
+        return f"Bloc {self.index} de {self.filename} reçu"
+    
+    def abort(self):
+        os.close(self.fd)
+
+def valid_filename(filename):
+    """Nom de fichier partagé: ni chemin (traversée hors du dossier), ni fichier caché (transferts en cours)"""
+    return (bool(filename) and '/' not in filename and '\\' not in filename and '\0' not in filename
+            and not filename.startswith('.'))
+
+def parse_options(tokens):
+    """Analyse des arguments "clé=valeur" séparés par des espaces"""
+    options = {}
+    for token in ' '.join(tokens).split():
+        key, separator, value = token.partition('=')
+        if not separator:
+            raise ValueError(f"Option invalide: {token}")
+        options[key.lower()] = value
+    return options
+
+class CommandParser:
+    """Découpe le flux reçu en commandes selon le tramage négocié
+    
+    - 'legacy': chaque lecture est une commande (protocole d'origine)
+    - 'length': chaque trame est précédée de sa longueur sur 4 octets (big-endian)
+    """
+    
+    def __init__(self, max_frame_size=1024 * 1024):
+        self.mode = 'legacy'
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+    
+    def feed(self, data):
+        """Ajoute des octets reçus au tampon"""
+        self.buffer += data
+    
+    def next_frame(self):
+        """Retourne la prochaine commande complète, ou None s'il faut lire davantage"""
+        if not self.buffer:
+            return None
+        
+        if self.mode == 'length':
+            if len(self.buffer) < 4:
+                return None
+            size = int.from_bytes(self.buffer[:4], 'big')
+            if size > self.max_frame_size:
+                raise ValueError(f"Trame trop grande ({size} octets)")
+            if len(self.buffer) < 4 + size:
+                return None
+            frame = bytes(self.buffer[4:4 + size])
+            del self.buffer[:4 + size]
+            return frame
+        
+        # Mode d'origine: la poignée de main FRAMING peut être suivie de trames
+        if self.buffer.startswith(b'FRAMING ') and b'\n' in self.buffer:
+            end = self.buffer.index(b'\n')
+            frame = bytes(self.buffer[:end]).rstrip(b'\r')
+            del self.buffer[:end + 1]
+            return frame
+        frame = bytes(self.buffer)
+        self.buffer.clear()
+        return frame
+    
+    def take(self, size):
+        """Retire jusqu'à size octets bruts déjà reçus (données d'un UPLOAD)"""
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+    
+    def encode(self, payload):
+        """Encapsule un message sortant selon le tramage courant"""
+        if self.mode == 'length':
+            return len(payload).to_bytes(4, 'big') + payload
+        return payload
+
+class ClientSession:
+    """État d'une connexion cliente, commun aux moteurs thread et asyncio
+    
+    Les réponses partent directement depuis le thread du client; les messages
+    diffusés passent par une file sortante bornée vidée par le Broadcaster.
+    """
+    
+    def __init__(self, address, sock, max_frame_size=1024 * 1024, queue_limit=256):
+        self.address = address
+        self.username = None
+        self.authenticated = False
+        self.token = None
+        self.closing = False
+        self.busy = False  # Transfert en cours: laissé aller au bout lors de la fermeture planifiée
+        self.pause = 0  # Attente avant la lecture suivante (débit de commandes dépassé)
+        self.parser = CommandParser(max_frame_size)
+        self.sock = sock
+        self._send = sock.sendall if sock is not None else None
+        self._lock = threading.Lock()
+        self._corked = False
+        self._pending = []
+        # File sortante des messages diffusés et reste d'un envoi non bloquant partiel
+        self.outbox = collections.deque()
+        self._queue_lock = threading.Lock()  # Distinct de _lock: un envoi bloqué ne bloque pas l'émetteur
+        self.queue_limit = queue_limit
+        self.dropped = 0
+        self._partial = b''
+        self.wake = lambda: None
+        self.last_sent = time.monotonic()  # Dernier envoi: compte comme activité pour IDLE_TIMEOUT
+    
+    @property
+    def framed(self):
+        """Tramage par longueur négocié (FRAMING LEN)"""
+        return self.parser.mode == 'length'
+    
+    def _take_output(self, message=None):
+        """Données à écrire en priorité, puis le message (verrou tenu)"""
+        chunks = [self._partial] if self._partial else []
+        self._partial = b''
+        with self._queue_lock:
+            queued = list(self.outbox)
+            self.outbox.clear()
+        chunks.extend(self.parser.encode(queued_message) for queued_message in queued)
+        if message is not None:
+            chunks.append(self.parser.encode(message))
+        if chunks:
+            self.last_sent = time.monotonic()
+        return chunks
+    
+    def send(self, message):
+        """Envoie un message (str ou bytes) au client, tramé selon le mode négocié"""
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        with self._lock:
+            chunks = self._take_output(message)
+            if self._corked:
+                self._pending.extend(chunks)
+            else:
+                self._send(b''.join(chunks))
+        self._rewake()
+    
+    def enqueue(self, message, drop_oldest=False):
+        """Ajoute un message diffusé à la file sortante; False si elle est pleine
+        
+        Une session bouchée (lot de réponses ou transfert en cours) ne lit pas sa
+        file: elle n'est pas un client lent, ses plus vieux messages sont abandonnés.
+        """
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        with self._queue_lock:
+            if len(self.outbox) >= self.queue_limit:
+                if not drop_oldest and not self._corked:
+                    return False
+                self.outbox.popleft()
+                self.dropped += 1
+            self.outbox.append(message)
+        return True
+    
+    def write_pending(self):
+        """Écrit sans bloquer la file sortante (thread du Broadcaster)
+        
+        Retourne None si tout est parti, 'busy' si le client est occupé
+        (réponse ou transfert en cours), 'blocked' si le socket est plein et
+        'dead' si la connexion est rompue.
+        """
+        if not self._lock.acquire(blocking=False):
+            return 'busy'
+        try:
+            if self._corked:
+                return 'busy' if self.outbox else None
+            if not self._partial and not self.outbox:
+                return None
+            # Tant que le reste d'un envoi partiel n'est pas parti, la file s'allonge
+            data = self._partial or b''.join(self._take_output())
+            self._partial = b''
+            try:
+                sent = self.sock.send(data, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                return 'dead'
+            self._partial = data[sent:]
+            return 'blocked' if self._partial else None
+        finally:
+            self._lock.release()
+    
+    def stop_reading(self):
+        """Fermeture en douceur: la lecture suivante voit la fin du flux, les envois en cours aboutissent"""
+        self.closing = True
+        try:
+            self.sock.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+    
+    def disconnect(self):
+        """Coupe un client trop lent; son thread se termine à la lecture suivante"""
+        self.closing = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def cork(self):
+        """Accumule les messages sortants jusqu'à uncork()"""
+        with self._lock:
+            self._corked = True
+    
+    def flush(self):
+        """Envoie en une seule écriture les messages accumulés"""
+        with self._lock:
+            chunks = self._pending + self._take_output()
+            self._pending = []
+            if chunks:
+                self._send(b''.join(chunks))
+        self._rewake()
+    
+    def uncork(self):
+        """Envoie les messages accumulés et repasse en envoi immédiat"""
+        with self._lock:
+            self._corked = False
+            chunks = self._pending + self._take_output()
+            self._pending = []
+            if chunks:
+                self._send(b''.join(chunks))
+        self._rewake()
+    
+    def _rewake(self):
+        # Un message diffusé pendant l'envoi a trouvé le verrou pris ('busy'): le Broadcaster doit repasser
+        if self.outbox and not self._corked:
+            self.wake()
+
+class AsyncClientSession(ClientSession):
+    """Session du moteur asyncio: la file sortante est vidée par la boucle elle-même"""
+    
+    def __init__(self, address, writer, max_frame_size=1024 * 1024, queue_limit=256, max_buffered=1024 * 1024):
+        super().__init__(address, None, max_frame_size, queue_limit)
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.max_buffered = max_buffered
+        self._send = writer.write
+        self._scheduled = False
+        self.wake = self.schedule_flush
+    
+    def schedule_flush(self):
+        """Programme l'écriture de la file sortante (appelable depuis n'importe quel thread)"""
+        if not self._scheduled:
+            self._scheduled = True
+            self.loop.call_soon_threadsafe(self._flush_outbox)
+    
+    def _flush_outbox(self):
+        self._scheduled = False
+        with self._lock:
+            if self._corked or not self.outbox or self.writer.is_closing():
+                return
+            if self.writer.transport.get_write_buffer_size() > self.max_buffered:
+                # Client lent: les messages restent en file (bornée) et on réessaie
+                self.loop.call_later(0.05, self.schedule_flush)
+                return
+            self._send(b''.join(self._take_output()))
+    
+    def stop_reading(self):
+        # La fermeture du transport (après envoi du tampon) termine la lecture en cours
+        self.closing = True
+        self.writer.close()
+    
+    def disconnect(self):
+        self.closing = True
+        self.writer.transport.abort()
+
+class Broadcaster:
+    """Diffusion du chat sans bloquer l'émetteur
+    
+    Chaque message est déposé dans la file bornée de chaque destinataire; un
+    thread d'écriture dédié regroupe les messages en attente de chaque client
+    en un seul envoi non bloquant. Quand une file déborde, la politique
+    'disconnect' coupe le client lent et 'drop' abandonne ses plus vieux messages;
+    un client occupé par un transfert perd toujours ses plus vieux messages.
+    """
+    
+    def __init__(self, policy='disconnect'):
+        self.policy = policy
+        self.sessions = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+    
+    def register(self, session):
+        if session.sock is not None:
+            session.wake = self.wakeup.set
+        with self.lock:
+            self.sessions.add(session)
+    
+    def unregister(self, session):
+        with self.lock:
+            self.sessions.discard(session)
+    
+    def publish(self, message):
+        """Dépose un message dans la file de chaque client connecté"""
+        with self.lock:
+            targets = list(self.sessions)
+        for session in targets:
+            if session.enqueue(message, drop_oldest=self.policy == 'drop'):
+                session.wake()
+            else:
+                print(f"[Chat] {session.address} trop lent, déconnecté.")
+                self.unregister(session)
+                session.disconnect()
+    
+    def run(self):
+        """Boucle du thread d'écriture des sessions en mode thread"""
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while True:
+                with self.lock:
+                    targets = [session for session in self.sessions if session.sock is not None]
+                blocked = []
+                for session in targets:
+                    # Une session en erreur ne doit pas arrêter le thread: les autres n'auraient plus le chat
+                    try:
+                        status = session.write_pending()
+                    except Exception as e:
+                        print(f"[Chat] Erreur d'envoi vers {session.address}: {e}")
+                        status = 'dead'
+                    if status == 'blocked':
+                        blocked.append(session.sock)
+                    elif status == 'dead':
+                        self.unregister(session)
+                        session.disconnect()
+                if not blocked:
+                    break
+                # Attendre qu'un socket plein se libère ou qu'un nouveau message arrive
+                try:
+                    select.select([], blocked, [], 0.05)
+                except (OSError, ValueError):
+                    pass
+
+class Metrics:
+    """Compteurs, jauges et histogrammes en mémoire, exposés au format texte de Prometheus
+    
+    Les métriques sont déclarées une fois (describe) puis mises à jour depuis
+    n'importe quel thread; les jauges calculées (queue depths, caches) sont
+    lues seulement au moment de l'exposition.
+    """
+    
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    
+    def __init__(self, prefix='fileshare'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.types = {}
+        self.help = {}
+        self.values = {}  # (nom, labels) -> valeur (compteurs et jauges)
+        self.histograms = {}  # (nom, labels) -> [compte par intervalle..., somme, total]
+        self.collectors = {}  # nom -> fonction retournant une valeur ou {labels: valeur}
+    
+    def describe(self, name, kind, help_text, collector=None):
+        self.types[name] = kind
+        self.help[name] = help_text
+        if collector is not None:
+            self.collectors[name] = collector
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.BUCKETS, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.BUCKETS) + 3)
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+    
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{str(value)}"' for key, value in pairs) + '}'
+    
+    def render(self):
+        """Texte d'exposition Prometheus (version 0.0.4)"""
+        with self.lock:
+            values = dict(self.values)
+            histograms = {key: list(histogram) for key, histogram in self.histograms.items()}
+        for name, collector in self.collectors.items():
+            try:
+                result = collector()
+            except Exception:
+                continue
+            if isinstance(result, dict):
+                for labels, value in result.items():
+                    values[(name, labels)] = value
+            else:
+                values[(name, ())] = result
+        
+        lines = []
+        for name in sorted(self.types):
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {self.help[name]}")
+            lines.append(f"# TYPE {full_name} {self.types[name]}")
+            if self.types[name] == 'histogram':
+                for (metric, labels), histogram in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.BUCKETS + ('+Inf',), histogram):
+                        cumulative += count
+                        lines.append(f"{full_name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{full_name}_sum{self._labels(labels)} {histogram[-2]!r}")
+                    lines.append(f"{full_name}_count{self._labels(labels)} {histogram[-1]}")
+            else:
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{full_name}{self._labels(labels)} {value!r}")
+        return '\n'.join(lines) + '\n'
+
+class SamplingProfiler:
+    """Profileur par échantillonnage, activable et désactivable sans redémarrer
+    
+    Un thread relève la pile de tous les autres threads toutes les interval
+    secondes et compte les piles identiques. Le résultat est au format
+    "piles repliées" (fonction;fonction;... nombre), lisible par flamegraph.pl
+    ou speedscope. Arrêté, il ne coûte rien.
+    """
+    
+    def __init__(self, interval=0.01, max_stacks=10000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.lock = threading.Lock()
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started_at = None
+        self.thread = None
+        self.stop_event = threading.Event()
+    
+    @property
+    def running(self):
+        return self.thread is not None
+    
+    def start(self, interval=None):
+        with self.lock:
+            if self.thread is not None:
+                return False
+            if interval:
+                self.interval = interval
+            self.stacks.clear()
+            self.samples = 0
+            self.started_at = time.time()
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True, name='profiler')
+            self.thread.start()
+        return True
+    
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is None:
+            return False
+        self.stop_event.set()
+        thread.join()
+        return True
+    
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stack = ';'.join(f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                                     for entry in traceback.extract_stack(frame))
+                    if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[stack] += 1
+                self.samples += 1
+    
+    def report(self):
+        """Piles repliées, des plus fréquentes aux plus rares"""
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks)
+
+class WorkerBus:
+    """Bus local entre les workers: socket Unix, un événement JSON par ligne
+    
+    Le worker 0 héberge le bus et fait autorité pour le chat: il attribue les
+    identifiants et écrit le journal, puis renvoie chaque message à tous les
+    workers. Les autres événements (présence, jetons de session, fichiers
+    publiés) sont relayés tels quels aux autres workers.
+    """
+    
+    def __init__(self, server, path, worker_id, connect_timeout=10):
+        self.server = server
+        self.path = path
+        self.worker_id = worker_id
+        self.is_hub = worker_id == 0
+        self.connect_timeout = connect_timeout
+        self.peers = {}  # Hub: socket -> (verrou d'envoi, numéro du worker)
+        self.sock = None
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+    
+    def start(self):
+        if self.is_hub:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(self.path)
+            listener.listen(64)
+            threading.Thread(target=self._accept_loop, args=(listener,), daemon=True).start()
+            return
+        deadline = time.time() + self.connect_timeout
+        while True:
+            try:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(self.path)
+                break
+            except OSError:
+                self.sock.close()
+                if time.time() > deadline:
+                    print(f"[Workers] Bus {self.path} injoignable, worker {self.worker_id} isolé")
+                    self.sock = None
+                    return
+                time.sleep(0.1)
+        self._send(self.sock, self.send_lock, {'type': 'hello', 'worker': self.worker_id})
+        threading.Thread(target=self._read_loop, args=(self.sock, None), daemon=True).start()
+    
+    @staticmethod
+    def _send(sock, lock, event):
+        data = (json.dumps(event) + '\n').encode('utf-8')
+        try:
+            with lock:
+                sock.sendall(data)
+        except OSError:
+            pass
+    
+    def publish(self, event):
+        """Diffuse un événement de ce worker aux autres"""
+        event = dict(event, worker=self.worker_id)
+        if self.is_hub:
+            self._relay(event, origin=None)
+        elif self.sock is not None:
+            self._send(self.sock, self.send_lock, event)
+    
+    def relay_session(self, action, token, entry):
+        self.publish({'type': 'session', 'action': action, 'token': token, 'entry': entry})
+    
+    def _relay(self, event, origin):
+        """Hub: envoie l'événement à tous les workers sauf celui d'origine"""
+        with self.lock:
+            peers = [(sock, lock) for sock, (lock, _) in self.peers.items() if sock is not origin]
+        for sock, lock in peers:
+            self._send(sock, lock, event)
+    
+    def _accept_loop(self, listener):
+        while True:
+            sock, _ = listener.accept()
+            with self.lock:
+                self.peers[sock] = (threading.Lock(), None)
+            threading.Thread(target=self._read_loop, args=(sock, sock), daemon=True).start()
+    
+    def _read_loop(self, sock, origin):
+        worker = None
+        try:
+            for line in sock.makefile('rb'):
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('type') == 'hello':
+                    worker = event['worker']
+                    continue
+                if self.is_hub and event.get('type') == 'chat':
+                    # Le hub attribue l'identifiant puis renvoie le message à tous, émetteur compris
+                    record = self.server.chat_history.append(event['user'], event['text'], event['timestamp'])
+                    self._relay({'type': 'chat_record', 'record': record, 'worker': self.worker_id}, origin=None)
+                    self.server.deliver_chat(record)
+                    continue
+                if self.is_hub:
+                    self._relay(event, origin)
+                self.server.apply_bus_event(event)
+        except OSError:
+            pass
+        finally:
+            if self.is_hub:
+                with self.lock:
+                    self.peers.pop(sock, None)
+                if worker is not None:
+                    # Les utilisateurs de ce worker ne sont plus connectés
+                    reset = {'type': 'presence', 'worker': worker, 'reset': True}
+                    self._relay(reset, origin=None)
+                    self.server.apply_bus_event(reset)
+            else:
+                print(f"[Workers] Bus fermé, worker {self.worker_id} isolé")
+                self.sock = None
+            sock.close()
+
+class ChatStream:
+    """Réveil des flux SSE du chat, abonné une seule fois au Broadcaster
     
-    def get_local_time(self):
-        """Retourne l'heure locale avec le décalage de fuseau"""
-        return datetime.utcnow() + timedelta(hours=self.timezone_offset)
+    Les messages ne sont pas copiés par abonné: chaque flux relit l'historique
+    en mémoire à partir du dernier identifiant envoyé, ce qui sert aussi à la
+    reprise (Last-Event-ID) et au rattrapage d'un navigateur lent.
+    """
     
-    def is_within_time_window(self):
-        """Vérifie si l'heure actuelle est dans la plage autorisée (7h-22h)"""
-        current_hour = self.get_local_time().hour
-        return self.start_hour <= current_hour < self.end_hour
+    def __init__(self, broadcaster):
+        self.address = 'chat-stream'
+        self.sock = None
+        self.condition = threading.Condition()
+        broadcaster.register(self)
     
-    def load_accounts(self):
-        if os.path.exists(self.accounts_file):
-            try:
-                with open(self.accounts_file, 'r') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
+    def enqueue(self, message, drop_oldest=False):
+        return True
     
-    def save_accounts(self):
-        with open(self.accounts_file, 'w') as f:
-            json.dump(self.accounts, f)
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
     
-    def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
+    def disconnect(self):
+        pass
     
-    def register_account(self, username, password):
-        if username in self.accounts:
-            return False, "Nom d'utilisateur déjà existant"
-        
-        self.accounts[username] = {
-            'password': self.hash_password(password),
-            'created_at': time.time()
-        }
-        self.save_accounts()
-        return True, "Compte créé avec succès"
+    def wait(self, history, last_id, timeout):
+        """Attend un message plus récent que last_id; False si le délai expire"""
+        with self.condition:
+            return self.condition.wait_for(lambda: history.last_id > last_id, timeout)
+
+# Gabarit de la page de statut: découpé une seule fois, seuls les champs entre accolades
+# sont remplis à chaque rendu
+STATUS_PAGE_TEMPLATE = """\
+<!DOCTYPE html>
+<html lang="fr">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Serveur de Partage de Fichiers</title>
+    <style>
+        :root {{
+            --primary: #4361ee;
+            --success: #4cc9f0;
+            --danger: #f72585;
+            --warning: #fca311;
+            --dark: #14213d;
+            --light: #f8f9fa;
+        }}
+
+        * {{
+            margin: 0;
+            padding: 0;
+            box-sizing: border-box;
+        }}
+
+        body {{
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: #333;
+            min-height: 100vh;
+            padding: 20px;
+        }}
+
+        .container {{
+            max-width: 1000px;
+            margin: 0 auto;
+            background: rgba(255, 255, 255, 0.95);
+            border-radius: 15px;
+            box-shadow: 0 10px 30px rgba(0, 0, 0, 0.2);
+            overflow: hidden;
+        }}
+
+        header {{
+            background: var(--primary);
+            color: white;
+            padding: 2rem;
+            text-align: center;
+        }}
+
+        h1 {{
+            font-size: 2.5rem;
+            margin-bottom: 0.5rem;
+        }}
+
+        .subtitle {{
+            font-size: 1.2rem;
+            opacity: 0.9;
+        }}
+
+        .content {{
+            padding: 2rem;
+        }}
+
+        .status-container {{
+            display: flex;
+            justify-content: center;
+            margin-bottom: 2rem;
+        }}
+
+        .status {{
+            padding: 1rem 2rem;
+            border-radius: 50px;
+            font-weight: bold;
+            text-align: center;
+            display: inline-flex;
+            align-items: center;
+            gap: 10px;
+        }}
+
+        .status.online {{
+            background: #d4edda;
+            color: #155724;
+            box-shadow: 0 4px 15px rgba(76, 201, 240, 0.3);
+        }}
+
+        .status.offline {{
+            background: #f8d7da;
+            color: #721c24;
+            box-shadow: 0 4px 15px rgba(247, 37, 133, 0.3);
+        }}
+
+        .status-dot {{
+            width: 12px;
+            height: 12px;
+            border-radius: 50%;
+            display: inline-block;
+        }}
+
+        .online .status-dot {{
+            background: #28a745;
+            box-shadow: 0 0 10px #28a745;
+        }}
+
+        .offline .status-dot {{
+            background: #dc3545;
+            box-shadow: 0 0 10px #dc3545;
+        }}
+
+        .info-grid {{
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
+            gap: 1.5rem;
+            margin-bottom: 2rem;
+        }}
+
+        .info-card {{
+            background: white;
+            padding: 1.5rem;
+            border-radius: 10px;
+            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
+            border-left: 4px solid var(--primary);
+        }}
+
+        .info-card h3 {{
+            color: var(--primary);
+            margin-bottom: 1rem;
+            display: flex;
+            align-items: center;
+            gap: 10px;
+        }}
+
+        .info-card p {{
+            margin-bottom: 0.5rem;
+            line-height: 1.6;
+        }}
+
+        .highlight {{
+            font-weight: bold;
+            color: var(--primary);
+        }}
+
+        .commands {{
+            background: var(--light);
+            padding: 1.5rem;
+            border-radius: 10px;
+            margin-top: 2rem;
+        }}
+
+        .commands h2 {{
+            color: var(--dark);
+            margin-bottom: 1rem;
+            text-align: center;
+        }}
+
+        .command-list {{
+            list-style: none;
+        }}
+
+        .command-list li {{
+            background: white;
+            margin-bottom: 0.5rem;
+            padding: 1rem;
+            border-radius: 8px;
+            border-left: 3px solid var(--success);
+            font-family: 'Courier New', monospace;
+        }}
+
+        .countdown {{
+            text-align: center;
+            margin-top: 1rem;
+            font-size: 1.1rem;
+            color: var(--dark);
+        }}
+
+        footer {{
+            text-align: center;
+            padding: 1.5rem;
+            background: var(--dark);
+            color: white;
+            margin-top: 2rem;
+        }}
+
+        @media (max-width: 768px) {{
+            .info-grid {{
+                grid-template-columns: 1fr;
+            }}
+
+            h1 {{
+                font-size: 2rem;
+            }}
+        }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <header>
+            <h1>📁 Serveur de Partage de Fichiers</h1>
+            <p class="subtitle">Partagez, discutez, collaborez</p>
+        </header>
+
+        <div class="content">
+            <div class="status-container">
+                <div class="status {status_class}">
+                    <span class="status-dot"></span>
+                    {status_text}
+                </div>
+            </div>
+
+            <div class="info-grid">
+                <div class="info-card">
+                    <h3>🕐 Horaires de service</h3>
+                    <p><span class="highlight">Ouverture:</span> 7h00</p>
+                    <p><span class="highlight">Fermeture:</span> 22h00</p>
+                    <p><span class="highlight">Fuseau horaire:</span> UTC+2 (Paris)</p>
+                </div>
+
+                <div class="info-card">
+                    <h3>📊 Statut actuel</h3>
+                    <p><span class="highlight">Heure locale:</span> {time}</p>
+                    <p><span class="highlight">Date:</span> {date}</p>
+                    <p><span class="highlight">Port service:</span> {port}</p>
+                </div>
+
+                <div class="info-card">
+                    <h3>📞 Contact</h3>
+                    <p>Le serveur est automatiquement géré</p>
+                    <p>Fonctionne de 7h à 22h</p>
+                    <p>Reconnexion automatique chaque matin</p>
+                </div>
+            </div>
+
+            <div class="countdown">
+                <p>Prochain changement de statut dans: {hours}h {minutes}m {seconds}s</p>
+            </div>
+
+            <div class="commands">
+                <h2>💻 Commandes disponibles</h2>
+                <ul class="command-list">
+                    <li><code>register [username] [password]</code> - Créer un compte</li>
+                    <li><code>login [username] [password]</code> - Se connecter</li>
+                    <li><code>upload [filename]</code> - Uploader un fichier</li>
+                    <li><code>download [filename]</code> - Télécharger un fichier</li>
+                    <li><code>list</code> - Lister les fichiers disponibles</li>
+                    <li><code>chat [message]</code> - Envoyer un message</li>
+                    <li><code>logout</code> - Se déconnecter</li>
+                </ul>
+            </div>
+        </div>
+
+        <footer>
+            <p>Serveur de partage de fichiers avec chat | © 2023</p>
+        </footer>
+    </div>
+
+    <script>
+        // Mise à jour du compte à rebours
+        function updateCountdown() {{
+            const countdownElement = document.querySelector('.countdown p');
+            if (countdownElement) {{
+                const text = countdownElement.textContent;
+                const regex = /(\\d+)h (\\d+)m (\\d+)s/;
+                const match = text.match(regex);
+
+                if (match) {{
+                    let hours = parseInt(match[1]);
+                    let minutes = parseInt(match[2]);
+                    let seconds = parseInt(match[3]);
+
+                    seconds--;
+                    if (seconds < 0) {{
+                        seconds = 59;
+                        minutes--;
+                        if (minutes < 0) {{
+                            minutes = 59;
+                            hours--;
+                            if (hours < 0) {{
+                                // Recharger la page quand le temps est écoulé
+                                location.reload();
+                                return;
+                            }}
+                        }}
+                    }}
+
+                    countdownElement.textContent = 
+                        `Prochain changement de statut dans: ${{hours}}h ${{minutes}}m ${{seconds}}s`;
+                }}
+            }}
+        }}
+
+        // Mettre à jour le compte à rebours chaque seconde
+        setInterval(updateCountdown, 1000);
+    </script>
+</body>
+</html>
+"""
+
+class StatusPage:
+    """Page de statut et /status.json pré-rendus, compressés et mis en cache
     
-    def authenticate(self, username, password):
-        if username not in self.accounts:
-            return False, "Nom d'utilisateur incorrect"
+    Les champs dynamiques ne changent qu'à la seconde: chaque rendu (corps, version
+    gzip, ETag) est partagé par toutes les requêtes de la même seconde.
+    """
+    
+    def __init__(self, server, template=STATUS_PAGE_TEMPLATE):
+        self.server = server
+        self.parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+        self.lock = threading.Lock()
+        self.second = None
+        self.resources = {}
+    
+    def fields(self, now):
+        """Valeurs dynamiques de la page à l'instant now"""
+        server = self.server
+        local_time = datetime.utcfromtimestamp(now) + timedelta(hours=server.timezone_offset)
+        is_online = server.start_hour <= local_time.hour < server.end_hour
         
-        if self.accounts[username]['password'] != self.hash_password(password):
-            return False, "Mot de passe incorrect"
+        # Calcul du temps jusqu'au prochain changement de statut
+        if is_online:
+            # Temps jusqu'à 22h
+            next_change = local_time.replace(hour=server.end_hour, minute=0, second=0, microsecond=0)
+            if local_time.hour >= server.end_hour:
+                next_change += timedelta(days=1)
+        else:
+            # Temps jusqu'à 7h
+            next_change = local_time.replace(hour=server.start_hour, minute=0, second=0, microsecond=0)
+            if local_time.hour >= server.start_hour:
+                next_change += timedelta(days=1)
         
-        return True, "Authentification réussie"
+        time_until_change = next_change - local_time
+        hours, remainder = divmod(time_until_change.seconds, 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return {
+            'online': is_online,
+            'status_class': "online" if is_online else "offline",
+            'status_text': "En ligne" if is_online else "Hors service",
+            'time': local_time.strftime('%H:%M:%S'),
+            'date': local_time.strftime('%d/%m/%Y'),
+            'port': server.port,
+            'hours': hours,
+            'minutes': minutes,
+            'seconds': seconds,
+            'next_change': next_change.strftime('%Y-%m-%dT%H:%M:%S'),
+            'until_change': time_until_change.seconds,
+        }
     
-    def handle_client(self, client_socket, address):
-        print(f"[Nouvelle connexion] {address} connecté.")
-        username = None
-        authenticated = False
+    def render(self, fields):
+        return ''.join(literal + (str(fields[field]) if field else '') for literal, field in self.parts)
+    
+    def get(self, name):
+        """(corps, corps gzip, ETag, Last-Modified) de 'html' ou 'json' pour la seconde courante"""
+        now = int(time.time())
+        with self.lock:
+            if now != self.second:
+                fields = self.fields(now)
+                status = {
+                    'status': fields['status_class'],
+                    'online': fields['online'],
+                    'time': f"{fields['date']} {fields['time']}",
+                    'next_change': fields['next_change'],
+                    'seconds_until_change': fields['until_change'],
+                    'port': fields['port'],
+                }
+                last_modified = formatdate(now, usegmt=True)
+                self.resources = {}
+                for key, body in (('html', self.render(fields)), ('json', json.dumps(status))):
+                    body = body.encode('utf-8')
+                    etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+                    self.resources[key] = (body, gzip.compress(body, 6), etag, last_modified)
+                self.second = now
+            return self.resources[name]
+
+class WebHandler(BaseHTTPRequestHandler):
+    # Connexions persistantes: chaque réponse annonce sa longueur, et les
+    # en-têtes et le corps partent sans attendre l'acquittement (pas de Nagle)
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    
+    def setup(self):
+        # Un navigateur lent ou une connexion inactive ne garde pas son thread indéfiniment
+        self.timeout = server.web_timeout
+        super().setup()
+    
+    def log_message(self, format, *args):
+        # Pas de paramètres de requête dans le journal: ?token= porte un jeton de session (EventSource)
+        super().log_message('%s', re.sub(r'\?[^\s"\']*', '?…', format % args))
+    
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/':
+            self.send_cached(server.status_page.get('html'), 'text/html; charset=utf-8')
+        elif url.path == '/status.json':
+            self.send_cached(server.status_page.get('json'), 'application/json')
+        elif url.path == '/files':
+            self.list_files(urllib.parse.parse_qs(url.query))
+        elif url.path == '/chat/stream':
+            self.stream_chat(urllib.parse.parse_qs(url.query))
+        elif url.path == '/metrics':
+            if self.authorize_admin():
+                self.send_body(200, server.metrics.render().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+        elif url.path == '/debug/profile':
+            if self.authorize_debug():
+                self.send_body(200, server.profiler.report().encode('utf-8'), 'text/plain; charset=utf-8')
+        elif url.path == '/debug/bandwidth':
+            if self.authorize_debug():
+                self.send_json(200, {direction: shaper.limits() for direction, shaper in server.bandwidth.items()})
+        elif url.path.startswith('/files/'):
+            self.send_file(urllib.parse.unquote(url.path[len('/files/'):]))
+        else:
+            self.send_body(404, 'Page non trouvée'.encode('utf-8'), 'text/plain; charset=utf-8')
+    
+    def do_HEAD(self):
+        # Même réponse que GET, sans le corps (sondes de disponibilité)
+        self.do_GET()
+    
+    def do_PUT(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path.startswith('/files/'):
+            self.receive_file(urllib.parse.unquote(url.path[len('/files/'):]))
+        else:
+            self.send_body(404, 'Page non trouvée'.encode('utf-8'), 'text/plain; charset=utf-8')
+    
+    def do_POST(self):
+        # POST /files/<nom>: même envoi brut que PUT, pour les clients qui ne font que du POST
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/chat':
+            self.receive_chat()
+        elif url.path == '/debug/profile':
+            self.toggle_profiler(urllib.parse.parse_qs(url.query))
+        elif url.path == '/debug/bandwidth':
+            self.configure_bandwidth(urllib.parse.parse_qs(url.query))
+        else:
+            self.do_PUT()
+    
+    def authorize_admin(self):
+        """Accès en lecture à /metrics: libre, ou jeton METRICS_TOKEN en Bearer s'il est défini"""
+        if not server.metrics_token:
+            return True
+        scheme, _, credentials = self.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip(), server.metrics_token):
+            return True
+        self.send_json(401, {'error': "Jeton d'administration requis"})
+        return False
+    
+    def authorize_debug(self):
+        """Accès aux routes /debug (profileur, limites de débit): jeton METRICS_TOKEN obligatoire
         
+        Sans METRICS_TOKEN configuré, ces routes n'existent pas (404).
+        """
+        if not server.metrics_token:
+            self.send_body(404, 'Page non trouvée'.encode('utf-8'), 'text/plain; charset=utf-8')
+            return False
+        return self.authorize_admin()
+    
+    def toggle_profiler(self, query):
+        """POST /debug/profile?action=start[&interval=0.01] ou ?action=stop"""
+        if not self.authorize_debug():
+            return
+        action = query.get('action', [''])[-1]
+        if action == 'start':
+            try:
+                interval = float(query.get('interval', [0])[-1])
+            except ValueError:
+                interval = 0
+            changed = server.profiler.start(interval if interval > 0 else None)
+        elif action == 'stop':
+            changed = server.profiler.stop()
+        else:
+            self.send_json(400, {'error': "Format: /debug/profile?action=start|stop[&interval=secondes]"})
+            return
+        self.send_json(200, {'running': server.profiler.running, 'changed': changed,
+                             'samples': server.profiler.samples, 'interval': server.profiler.interval})
+    
+    def configure_bandwidth(self, query):
+        """POST /debug/bandwidth?direction=in|out[&user=octets/s][&global=octets/s] (0 = illimité)"""
+        if not self.authorize_debug():
+            return
+        direction = query.get('direction', [''])[-1]
         try:
-            while True:
-                # Recevoir la commande du client
-                request = client_socket.recv(1024).decode('utf-8')
-                if not request:
-                    break
-                
-                parts = request.split(' ', 2)
-                command = parts[0]
-                
-                if command == 'REGISTER':
-                    if len(parts) < 3:
-                        response = "ERREUR Format: REGISTER username password"
-                    else:
-                        success, message = self.register_account(parts[1], parts[2])
-                        if success:
-                            response = f"SUCCES {message}"
-                        else:
-                            response = f"ERREUR {message}"
-                
-                elif command == 'LOGIN':
-                    if len(parts) < 3:
-                        response = "ERREUR Format: LOGIN username password"
-                    else:
-                        success, message = self.authenticate(parts[1], parts[2])
-                        if success:
-                            username = parts[1]
-                            authenticated = True
-                            self.clients[username] = client_socket
-                            response = f"SUCCES {message}"
-                            # Envoyer l'historique du chat
-                            for msg in self.chat_history[-10:]:  # Les 10 derniers messages
-                                try:
-                                    client_socket.send(f"CHAT_HISTORY {msg}".encode('utf-8'))
-                                    time.sleep(0.1)  # Petit délai pour éviter la saturation
-                                except:
-                                    break
-                        else:
-                            response = f"ERREUR {message}"
-                
-                elif command == 'LOGOUT':
-                    if username in self.clients:
-                        del self.clients[username]
-                    authenticated = False
-                    username = None
-                    response = "SUCCES Déconnecté avec succès"
-                
-                elif command == 'UPLOAD':
-                    if not authenticated:
-                        response = "ERREUR Vous devez être connecté pour uploader un fichier"
-                    else:
-                        # Format: UPLOAD filename filesize filedata
-                        if len(parts) < 3:
-                            response = "ERREUR Format: UPLOAD filename filesize"
-                        else:
-                            filename = parts[1]
-                            filesize = int(parts[2])
-                            
-                            # Recevoir les données du fichier
-                            file_data = b''
-                            while len(file_data) < filesize:
-                                packet = client_socket.recv(4096)
-                                if not packet:
-                                    break
-                                file_data += packet
-                            
-                            # Sauvegarder le fichier
-                            filepath = os.path.join(self.files_dir, filename)
-                            with open(filepath, 'wb') as f:
-                                f.write(file_data)
-                            
-                            response = f"SUCCES Fichier {filename} uploadé avec succès"
-                
-                elif command == 'DOWNLOAD':
-                    if not authenticated:
-                        response = "ERREUR Vous devez être connecté pour télécharger un fichier"
-                    else:
-                        if len(parts) < 2:
-                            response = "ERREUR Format: DOWNLOAD filename"
-                        else:
-                            filename = parts[1]
-                            filepath = os.path.join(self.files_dir, filename)
-                            
-                            if os.path.exists(filepath):
-                                filesize = os.path.getsize(filepath)
-                                response = f"SUCCES {filesize}"
-                                
-                                # Envoyer le fichier
-                                with open(filepath, 'rb') as f:
-                                    while True:
-                                        bytes_read = f.read(4096)
-                                        if not bytes_read:
-                                            break
-                                        client_socket.sendall(bytes_read)
-                            else:
-                                response = f"ERREUR Fichier {filename} non trouvé"
-                
-                elif command == 'LIST':
-                    if not authenticated:
-                        response = "ERREUR Vous devez être connecté pour lister les fichiers"
-                    else:
-                        files = os.listdir(self.files_dir)
-                        if not files:
-                            response = "SUCCES Aucun fichier disponible"
-                        else:
-                            response = "SUCCES " + " ".join(files)
-                
-                elif command == 'CHAT':
-                    if not authenticated:
-                        response = "ERREUR Vous devez être connecté pour chatter"
-                    else:
-                        if len(parts) < 2:
-                            response = "ERREUR Format: CHAT message"
-                        else:
-                            message = f"{username} [{self.get_local_time().strftime('%H:%M:%S')}]: {parts[1]}"
-                            self.chat_history.append(message)
-                            
-                            # Diffuser le message à tous les clients connectés
-                            for user, sock in self.clients.items():
-                                try:
-                                    sock.send(f"CHAT {message}".encode('utf-8'))
-                                except:
-                                    # En cas d'erreur, supprimer le client
-                                    if user in self.clients:
-                                        del self.clients[user]
-                            
-                            response = "SUCCES Message envoyé"
-                
-                else:
-                    response = "ERREUR Commande non reconnue"
-                
-                # Envoyer la réponse
-                client_socket.send(response.encode('utf-8'))
+            rates = {f'{key}_rate': int(query[key][-1]) for key in ('user', 'global') if key in query}
+        except ValueError:
+            rates = None
+        if direction not in server.bandwidth or not rates or min(rates.values()) < 0:
+            self.send_json(400, {'error': "Format: /debug/bandwidth?direction=in|out[&user=octets/s][&global=octets/s]"})
+            return
+        self.send_json(200, {direction: server.set_bandwidth(direction, **rates)})
+    
+    def send_json(self, code, data, headers=None):
+        self.send_body(code, json.dumps(data).encode('utf-8'), 'application/json', headers)
+    
+    def client_ip(self):
+        """Adresse du client: celle ajoutée à X-Forwarded-For par un proxy de confiance, sinon celle du socket"""
+        forwarded = self.headers.get('X-Forwarded-For')
+        if forwarded and server.is_trusted_proxy(self.client_address[0]):
+            # Le dernier élément vient du proxy; ceux qui précèdent sont fournis par le client
+            return forwarded.split(',')[-1].strip() or self.client_address[0]
+        return self.client_address[0]
+    
+    def authorize(self, token=None):
+        """Utilisateur authentifié (Basic ou jeton de session Bearer), sinon répond 401/503 et None
         
-        except Exception as e:
-            print(f"Erreur avec {address}: {e}")
+        token: jeton passé dans l'URL, pour EventSource qui ne peut pas envoyer d'en-tête.
+        """
+        if not server.is_within_time_window():
+            self.send_json(503, {'error': "Serveur hors service (7h-22h)"}, {'Retry-After': '3600'})
+            return None
+        authorization = self.headers.get('Authorization') or (f"Bearer {token}" if token else '')
+        scheme, _, credentials = authorization.partition(' ')
+        username = None
+        if scheme.lower() == 'bearer':
+            # Même jeton que LOGIN/RESUME sur le protocole socket
+            username = server.sessions.resume(credentials.strip())
+            if username not in server.accounts:
+                username = None
+        elif scheme.lower() == 'basic':
+            try:
+                username, _, password = base64.b64decode(credentials.strip()).decode('utf-8').partition(':')
+            except (ValueError, UnicodeDecodeError):
+                username = None
+            else:
+                # Basic renvoie le mot de passe à chaque requête: seules les tentatives
+                # pas encore vérifiées comptent, dans le même quota que LOGIN. Derrière
+                # un proxy, quota et bannissement visent le client, jamais le proxy.
+                client = self.client_ip()
+                if server.guard.is_banned(client):
+                    verdict = 'banned'
+                elif not server.credentials_cached(username, password):
+                    verdict = server.guard.check_command(client, 'LOGIN')
+                else:
+                    verdict = None
+                if verdict is not None:
+                    server.metrics.inc('commands_throttled_total', command='LOGIN')
+                    self.close_connection = verdict == 'banned'
+                    self.send_json(429, {'error': "Trop de tentatives, réessayez plus tard"},
+                                   {'Retry-After': '60'})
+                    return None
+                success, _ = server.authenticate(username, password)
+                if not success:
+                    username = None
+        if username is None:
+            self.send_json(401, {'error': "Vous devez être connecté"},
+                           {'WWW-Authenticate': 'Basic realm="Serveur de fichiers", charset="UTF-8"'})
+        return username
+    
+    def stream_chat(self, query):
+        """GET /chat/stream: messages du chat en Server-Sent Events, reprise par Last-Event-ID"""
+        if self.authorize(query.get('token', [None])[-1]) is None:
+            return
+        history = server.chat_history
+        try:
+            last_id = int(self.headers.get('Last-Event-ID') or query['lastEventId'][-1])
+        except (KeyError, ValueError):
+            # Nouvelle connexion: les derniers messages, comme au LOGIN
+            last_id = max(0, history.last_id - server.chat_replay_depth)
         
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.send_header('X-Accel-Buffering', 'no')  # Pas de mise en tampon par un proxy
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        server.metrics.inc('sse_streams')
+        try:
+            self.wfile.write(b'retry: 3000\n\n')
+            while server.is_within_time_window():
+                records = history.after(last_id)
+                if records:
+                    events = []
+                    for record in records:
+                        data = json.dumps(dict(record, message=server.format_chat(record)))
+                        events.append(f"id: {record['id']}\nevent: chat\ndata: {data}\n\n")
+                    self.wfile.write(''.join(events).encode('utf-8'))
+                    last_id = records[-1]['id']
+                elif not server.chat_stream.wait(history, last_id, server.sse_keepalive):
+                    # Commentaire de maintien: détecte aussi les navigateurs partis
+                    self.wfile.write(b': ping\n\n')
+        except OSError:
+            pass
         finally:
-            if username and username in self.clients:
-                del self.clients[username]
-            client_socket.close()
-            print(f"[Déconnexion] {address} déconnecté.")
-
-class WebHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            
-            local_time = server.get_local_time()
-            is_online = server.is_within_time_window()
-            status_class = "online" if is_online else "offline"
-            status_text = "En ligne" if is_online else "Hors service"
-            
-            # Calcul du temps jusqu'au prochain changement de statut
-            if is_online:
-                # Temps jusqu'à 22h
-                next_change = local_time.replace(hour=22, minute=0, second=0, microsecond=0)
-                if local_time.hour >= 22:
-                    next_change += timedelta(days=1)
-            else:
-                # Temps jusqu'à 7h
-                next_change = local_time.replace(hour=7, minute=0, second=0, microsecond=0)
-                if local_time.hour >= 7:
-                    next_change += timedelta(days=1)
-            
-            time_until_change = next_change - local_time
-            hours, remainder = divmod(time_until_change.seconds, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            
-            html = f"""
-            <!DOCTYPE html>
-            <html lang="fr">
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>Serveur de Partage de Fichiers</title>
-                <style>
-                    :root {{
-                        --primary: #4361ee;
-                        --success: #4cc9f0;
-                        --danger: #f72585;
-                        --warning: #fca311;
-                        --dark: #14213d;
-                        --light: #f8f9fa;
-                    }}
-                    
-                    * {{
-                        margin: 0;
-                        padding: 0;
-                        box-sizing: border-box;
-                    }}
-                    
-                    body {{
-                        font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                        color: #333;
-                        min-height: 100vh;
-                        padding: 20px;
-                    }}
-                    
-                    .container {{
-                        max-width: 1000px;
-                        margin: 0 auto;
-                        background: rgba(255, 255, 255, 0.95);
-                        border-radius: 15px;
-                        box-shadow: 0 10px 30px rgba(0, 0, 0, 0.2);
-                        overflow: hidden;
-                    }}
-                    
-                    header {{
-                        background: var(--primary);
-                        color: white;
-                        padding: 2rem;
-                        text-align: center;
-                    }}
-                    
-                    h1 {{
-                        font-size: 2.5rem;
-                        margin-bottom: 0.5rem;
-                    }}
-                    
-                    .subtitle {{
-                        font-size: 1.2rem;
-                        opacity: 0.9;
-                    }}
-                    
-                    .content {{
-                        padding: 2rem;
-                    }}
-                    
-                    .status-container {{
-                        display: flex;
-                        justify-content: center;
-                        margin-bottom: 2rem;
-                    }}
-                    
-                    .status {{
-                        padding: 1rem 2rem;
-                        border-radius: 50px;
-                        font-weight: bold;
-                        text-align: center;
-                        display: inline-flex;
-                        align-items: center;
-                        gap: 10px;
-                    }}
-                    
-                    .status.online {{
-                        background: #d4edda;
-                        color: #155724;
-                        box-shadow: 0 4px 15px rgba(76, 201, 240, 0.3);
-                    }}
-                    
-                    .status.offline {{
-                        background: #f8d7da;
-                        color: #721c24;
-                        box-shadow: 0 4px 15px rgba(247, 37, 133, 0.3);
-                    }}
-                    
-                    .status-dot {{
-                        width: 12px;
-                        height: 12px;
-                        border-radius: 50%;
-                        display: inline-block;
-                    }}
-                    
-                    .online .status-dot {{
-                        background: #28a745;
-                        box-shadow: 0 0 10px #28a745;
-                    }}
-                    
-                    .offline .status-dot {{
-                        background: #dc3545;
-                        box-shadow: 0 0 10px #dc3545;
-                    }}
-                    
-                    .info-grid {{
-                        display: grid;
-                        grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-                        gap: 1.5rem;
-                        margin-bottom: 2rem;
-                    }}
-                    
-                    .info-card {{
-                        background: white;
-                        padding: 1.5rem;
-                        border-radius: 10px;
-                        box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
-                        border-left: 4px solid var(--primary);
-                    }}
-                    
-                    .info-card h3 {{
-                        color: var(--primary);
-                        margin-bottom: 1rem;
-                        display: flex;
-                        align-items: center;
-                        gap: 10px;
-                    }}
-                    
-                    .info-card p {{
-                        margin-bottom: 0.5rem;
-                        line-height: 1.6;
-                    }}
-                    
-                    .highlight {{
-                        font-weight: bold;
-                        color: var(--primary);
-                    }}
-                    
-                    .commands {{
-                        background: var(--light);
-                        padding: 1.5rem;
-                        border-radius: 10px;
-                        margin-top: 2rem;
-                    }}
-                    
-                    .commands h2 {{
-                        color: var(--dark);
-                        margin-bottom: 1rem;
-                        text-align: center;
-                    }}
-                    
-                    .command-list {{
-                        list-style: none;
-                    }}
-                    
-                    .command-list li {{
-                        background: white;
-                        margin-bottom: 0.5rem;
-                        padding: 1rem;
-                        border-radius: 8px;
-                        border-left: 3px solid var(--success);
-                        font-family: 'Courier New', monospace;
-                    }}
-                    
-                    .countdown {{
-                        text-align: center;
-                        margin-top: 1rem;
-                        font-size: 1.1rem;
-                        color: var(--dark);
-                    }}
-                    
-                    footer {{
-                        text-align: center;
-                        padding: 1.5rem;
-                        background: var(--dark);
-                        color: white;
-                        margin-top: 2rem;
-                    }}
-                    
-                    @media (max-width: 768px) {{
-                        .info-grid {{
-                            grid-template-columns: 1fr;
-                        }}
-                        
-                        h1 {{
-                            font-size: 2rem;
-                        }}
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <header>
-                        <h1>📁 Serveur de Partage de Fichiers</h1>
-                        <p class="subtitle">Partagez, discutez, collaborez</p>
-                    </header>
-                    
-                    <div class="content">
-                        <div class="status-container">
-                            <div class="status {status_class}">
-                                <span class="status-dot"></span>
-                                {status_text}
-                            </div>
-                        </div>
-                        
-                        <div class="info-grid">
-                            <div class="info-card">
-                                <h3>🕐 Horaires de service</h3>
-                                <p><span class="highlight">Ouverture:</span> 7h00</p>
-                                <p><span class="highlight">Fermeture:</span> 22h00</p>
-                                <p><span class="highlight">Fuseau horaire:</span> UTC+2 (Paris)</p>
-                            </div>
-                            
-                            <div class="info-card">
-                                <h3>📊 Statut actuel</h3>
-                                <p><span class="highlight">Heure locale:</span> {local_time.strftime('%H:%M:%S')}</p>
-                                <p><span class="highlight">Date:</span> {local_time.strftime('%d/%m/%Y')}</p>
-                                <p><span class="highlight">Port service:</span> {server.port}</p>
-                            </div>
-                            
-                            <div class="info-card">
-                                <h3>📞 Contact</h3>
-                                <p>Le serveur est automatiquement géré</p>
-                                <p>Fonctionne de 7h à 22h</p>
-                                <p>Reconnexion automatique chaque matin</p>
-                            </div>
-                        </div>
-                        
-                        <div class="countdown">
-                            <p>Prochain changement de statut dans: {hours}h {minutes}m {seconds}s</p>
-                        </div>
-                        
-                        <div class="commands">
-                            <h2>💻 Commandes disponibles</h2>
-                            <ul class="command-list">
-                                <li><code>register [username] [password]</code> - Créer un compte</li>
-                                <li><code>login [username] [password]</code> - Se connecter</li>
-                                <li><code>upload [filename]</code> - Uploader un fichier</li>
-                                <li><code>download [filename]</code> - Télécharger un fichier</li>
-                                <li><code>list</code> - Lister les fichiers disponibles</li>
-                                <li><code>chat [message]</code> - Envoyer un message</li>
-                                <li><code>logout</code> - Se déconnecter</li>
-                            </ul>
-                        </div>
-                    </div>
-                    
-                    <footer>
-                        <p>Serveur de partage de fichiers avec chat | © 2023</p>
-                    </footer>
-                </div>
-                
-                <script>
-                    // Mise à jour du compte à rebours
-                    function updateCountdown() {{
-                        const countdownElement = document.querySelector('.countdown p');
-                        if (countdownElement) {{
-                            const text = countdownElement.textContent;
-                            const regex = /(\\d+)h (\\d+)m (\\d+)s/;
-                            const match = text.match(regex);
-                            
-                            if (match) {{
-                                let hours = parseInt(match[1]);
-                                let minutes = parseInt(match[2]);
-                                let seconds = parseInt(match[3]);
-                                
-                                seconds--;
-                                if (seconds < 0) {{
-                                    seconds = 59;
-                                    minutes--;
-                                    if (minutes < 0) {{
-                                        minutes = 59;
-                                        hours--;
-                                        if (hours < 0) {{
-                                            // Recharger la page quand le temps est écoulé
-                                            location.reload();
-                                            return;
-                                        }}
-                                    }}
-                                }}
-                                
-                                countdownElement.textContent = 
-                                    `Prochain changement de statut dans: ${{hours}}h ${{minutes}}m ${{seconds}}s`;
-                            }}
-                        }}
-                    }}
-                    
-                    // Mettre à jour le compte à rebours chaque seconde
-                    setInterval(updateCountdown, 1000);
-                </script>
-            </body>
-            </html>
-            """
-            
-            self.wfile.write(html.encode('utf-8'))
+            server.metrics.inc('sse_streams', -1)
+    
+    def receive_chat(self):
+        """POST /chat: message en texte brut, formulaire (message=) ou JSON {"message": ...}"""
+        username = self.authorize()
+        if username is None:
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > server.max_frame_size:
+            self.close_connection = True
+            self.send_json(413, {'error': "Message trop long"})
+            return
+        body = self.rfile.read(length).decode('utf-8', 'replace')
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip()
+        if content_type == 'application/x-www-form-urlencoded':
+            text = urllib.parse.parse_qs(body).get('message', [''])[-1]
+        elif content_type == 'application/json':
+            try:
+                text = str(json.loads(body).get('message', ''))
+            except (ValueError, AttributeError):
+                text = ''
+        else:
+            text = body
+        # Un message tient sur une ligne du protocole socket
+        text = text.replace('\r', ' ').replace('\n', ' ').strip()
+        if not text:
+            self.send_json(400, {'error': "Format: message non vide"})
+            return
+        record = server.post_chat(username, text)
+        # Sur un worker secondaire, l'identifiant est attribué plus tard par le worker 0
+        reply = {'message': "Message envoyé"}
+        if record is not None:
+            reply['id'] = record['id']
+        self.send_json(201, reply)
+    
+    def valid_filename(self, filename):
+        if not valid_filename(filename):
+            self.send_json(400, {'error': f"Nom de fichier invalide: {filename}"})
+            return False
+        return True
+    
+    def list_files(self, query):
+        """GET /files?prefix=&sort=name|size|mtime&order=asc|desc&limit=&cursor= (comme LIST)"""
+        if self.authorize() is None:
+            return
+        options = {key: values[-1] for key, values in query.items()}
+        try:
+            entries, cursor = server.catalog.query(
+                prefix=options.get('prefix', ''),
+                sort=options.get('sort', 'name'),
+                descending=options.get('order', 'asc') == 'desc',
+                limit=min(int(options.get('limit', 100)), server.max_list_page),
+                cursor=options.get('cursor'))
+        except ValueError:
+            entries = None
+        if entries is None:
+            self.send_json(400, {'error': "Format: /files?prefix=&sort=name|size|mtime&order=asc|desc&limit=&cursor="})
         else:
-            self.send_response(404)
+            self.send_json(200, {'files': entries, 'cursor': cursor})
+    
+    def send_file(self, filename):
+        """Téléchargement en flux, avec reprise (Range: bytes=début-fin)"""
+        username = self.authorize()
+        if username is None or not self.valid_filename(filename):
+            return
+        info = server.storage.stat(filename)
+        if info is None:
+            self.send_json(404, {'error': f"Fichier {filename} non trouvé"})
+            return
+        filesize = info['size']
+        etag = '"' + (info['sha256'] or f"{info['mtime']!r}-{filesize}") + '"'
+        headers = {
+            'Accept-Ranges': 'bytes',
+            'ETag': etag,
+            'Last-Modified': formatdate(info['mtime'], usegmt=True),
+            'Content-Disposition': "attachment; filename*=UTF-8''" + urllib.parse.quote(filename),
+        }
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        
+        code, offset, length = 200, 0, filesize
+        byte_range = self.headers.get('Range')
+        if byte_range and self.headers.get('If-Range', etag) == etag:
+            bounds = self.parse_range(byte_range, filesize)
+            if bounds is None:
+                self.send_json(416, {'error': f"Plage invalide pour {filename} ({filesize} octets)"},
+                               {'Content-Range': f"bytes */{filesize}"})
+                return
+            if bounds != (0, filesize):
+                code, (offset, length) = 206, bounds
+                headers['Content-Range'] = f"bytes {offset}-{offset + length - 1}/{filesize}"
+        
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        shaper = server.bandwidth['out']
+        for path, segment_offset, segment_length in server.storage.segments(filename, offset, length):
+            buffer = server.hot_cache.get(path)
+            f = open(path, 'rb') if buffer is None else None
+            try:
+                for start, size in shaper.slices(segment_offset, segment_length):
+                    shaper.wait(username, size)
+                    if f is None:
+                        self.wfile.write(buffer[start:start + size])
+                    else:
+                        self.connection.sendfile(f, start, size)
+            finally:
+                if f is not None:
+                    f.close()
+        server.metrics.inc('transfer_bytes_total', length, direction='out')
+    
+    def parse_range(self, byte_range, filesize):
+        """(début, longueur) d'un en-tête Range à plage unique; toute la taille si non géré, None si invalide"""
+        unit, _, spec = byte_range.partition('=')
+        if unit.strip() != 'bytes' or ',' in spec:
+            # Plusieurs plages: le fichier entier est renvoyé
+            return 0, filesize
+        first, _, last = spec.strip().partition('-')
+        try:
+            if not first:
+                # Suffixe: les N derniers octets
+                length = min(int(last), filesize)
+                return (filesize - length, length) if length > 0 else None
+            start = int(first)
+            end = min(int(last), filesize - 1) if last else filesize - 1
+        except ValueError:
+            return 0, filesize
+        if start >= filesize or end < start:
+            return None
+        return start, end - start + 1
+    
+    def receive_file(self, filename):
+        """Envoi en flux du corps de la requête (PUT ou POST /files/<nom>), sans tout charger en mémoire"""
+        username = self.authorize()
+        if username is None or not self.valid_filename(filename):
+            return
+        if self.headers.get('Content-Length') is None:
+            self.close_connection = True
+            self.send_json(411, {'error': "Content-Length requis"})
+            return
+        try:
+            filesize = int(self.headers['Content-Length'])
+        except ValueError:
+            filesize = -1
+        if filesize < 0 or filesize > server.max_upload_size:
+            # Le corps ne sera pas lu: la connexion est fermée
+            self.close_connection = True
+            self.send_json(413, {'error': f"Fichier trop volumineux (maximum {server.max_upload_size} octets)"})
+            return
+        
+        upload = server.storage.writer(filename, filesize)
+        shaper = server.bandwidth['in']
+        try:
+            while upload.remaining:
+                packet = self.rfile.read(min(server.upload_buffer_size, upload.remaining))
+                if not packet:
+                    break
+                upload.write(packet)
+                shaper.wait(username, len(packet))
+        except OSError:
+            pass
+        server.metrics.inc('transfer_bytes_total', upload.received, direction='in')
+        if upload.remaining:
+            upload.abort()
+            self.close_connection = True
+            self.send_json(400, {'error': f"Transfert de {filename} interrompu ({upload.received}/{filesize} octets)"})
+            return
+        message = upload.commit()
+        server.file_published(filename, username, upload.sha256)
+        self.send_json(201, {'message': message, 'name': filename, 'size': filesize, 'sha256': upload.sha256})
+    
+    def send_cached(self, resource, content_type):
+        """Répond 304 si la version du client est à jour, sinon le corps (gzip si accepté)"""
+        body, compressed, etag, last_modified = resource
+        if self.is_not_modified(etag, last_modified):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Cache-Control', 'no-cache')
             self.end_headers()
-            self.wfile.write('Page non trouvée'.encode('utf-8'))
+            return
+        headers = {'ETag': etag, 'Last-Modified': last_modified, 'Cache-Control': 'no-cache',
+                   'Vary': 'Accept-Encoding'}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            body = compressed
+        self.send_body(200, body, content_type, headers)
+    
+    def is_not_modified(self, etag, last_modified):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(last_modified)
+            except (TypeError, ValueError):
+                return False
+        return False
+    
+    def send_body(self, code, body, content_type, headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+class WebServer(ThreadingHTTPServer):
+    """Serveur HTTP multithread soumis au ConnectionGuard (bannissements, connexions
+    par adresse et globales) avant de créer le thread, comme le serveur de fichiers
+    
+    Un proxy de confiance (TRUSTED_PROXIES) porte les connexions de tous les
+    navigateurs: seule la limite globale s'applique à son adresse.
+    """
+    
+    def verify_request(self, request, client_address):
+        return server.refuse_connection(client_address, per_ip=not server.is_trusted_proxy(client_address[0])) is None
+    
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            server.guard.release(client_address[0])
 
 def start_web_server():
     """Démarre le serveur web HTTP sur le port 80/443"""
@@ -555,7 +4125,11 @@ def start_web_server():
     if 'RENDER' in os.environ:
         web_port = int(os.environ.get('PORT', 10000))
     
-    web_server = HTTPServer(('0.0.0.0', web_port), WebHandler)
+    # Un thread par connexion: un client lent ne bloque plus les autres (ni la sonde de santé)
+    web_server = WebServer(('0.0.0.0', web_port), WebHandler, bind_and_activate=False)
+    web_server.request_queue_size = server.backlog
+    web_server.server_bind()
+    web_server.server_activate()
     print(f"[Web] Interface web démarrée sur le port {web_port}")
     print(f"[Web] Accès: http://localhost:{web_port}")
     web_server.serve_forever()
@@ -570,16 +4144,22 @@ def start_file_server():
         print("Le serveur s'arrête.")
         return
     
+    if server.engine == 'asyncio':
+        start_async_file_server()
+        return
+    
+    server.broadcaster.start()
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if server.worker_id is not None:
+        # Tous les workers écoutent sur le même port; le noyau répartit les connexions
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server_socket.bind((server.host, server.port))
-    server_socket.listen(5)
+    server_socket.listen(server.backlog)
+    # accept() rend la main chaque seconde pour vérifier l'heure de fermeture
+    server_socket.settimeout(1.0)
     
-    current_time = server.get_local_time()
-    print(f"[Démarrage] Serveur de fichiers démarré sur {server.host}:{server.port}")
-    print(f"[Plage horaire] Le serveur fonctionne de {server.start_hour}h à {server.end_hour}h")
-    print(f"[Fuseau horaire] UTC+{server.timezone_offset} (Heure de Paris)")
-    print(f"[Heure actuelle] {current_time.strftime('%d/%m/%Y %H:%M:%S')}")
+    print_startup_banner()
     
     try:
         while True:
@@ -590,7 +4170,25 @@ def start_file_server():
                 print("[Arrêt] Le serveur s'arrête car hors de la plage 7h-22h")
                 break
             
-            client_socket, address = server_socket.accept()
+            try:
+                client_socket, address = server_socket.accept()
+            except socket.timeout:
+                continue
+            refused = server.refuse_connection(address)
+            if refused is not None:
+                # Refus avant de créer le thread: une rafale ne coûte qu'un accept()
+                try:
+                    client_socket.send(f"ERREUR {ConnectionGuard.REFUSALS[refused]}".encode('utf-8'),
+                                       socket.MSG_DONTWAIT)
+                except OSError:
+                    pass
+                client_socket.close()
+                continue
+            # Afflux du démarrage: un jeton par connexion acceptée; pendant l'attente,
+            # les suivantes patientent dans la file de listen()
+            delay = server.admission_delay()
+            if delay:
+                time.sleep(delay)
             client_thread = threading.Thread(target=server.handle_client, args=(client_socket, address))
             client_thread.daemon = True
             client_thread.start()
@@ -600,16 +4198,101 @@ def start_file_server():
     except Exception as e:
         print(f"\n[Erreur] {e}")
     finally:
+        # Plus de nouvelles connexions; les transferts en cours ont drain_timeout pour finir
         server_socket.close()
+        server.drain()
         print("Serveur de fichiers arrêté.")
 
-if __name__ == "__main__":
-    server = FileShareServer()
+def print_startup_banner():
+    """Affiche les informations de démarrage du serveur de fichiers"""
+    current_time = server.get_local_time()
+    worker = f", worker {server.worker_id}" if server.worker_id is not None else ""
+    print(f"[Démarrage] Serveur de fichiers démarré sur {server.host}:{server.port} (moteur {server.engine}{worker})")
+    print(f"[Plage horaire] Le serveur fonctionne de {server.start_hour}h à {server.end_hour}h")
+    print(f"[Fuseau horaire] UTC+{server.timezone_offset} (Heure de Paris)")
+    print(f"[Heure actuelle] {current_time.strftime('%d/%m/%Y %H:%M:%S')}")
+
+async def serve_async():
+    """Sert toutes les connexions sur une seule boucle asyncio jusqu'à la fermeture"""
+    file_server = await asyncio.start_server(
+        server.handle_client_async, server.host, server.port,
+        backlog=server.backlog, limit=server.recv_buffer_size, reuse_address=True,
+        reuse_port=server.worker_id is not None)
+    print_startup_banner()
+    
+    async with file_server:
+        # Vérifier chaque seconde la plage horaire
+        while server.is_within_time_window():
+            await asyncio.sleep(1)
+        current_time = server.get_local_time()
+        print(f"[Arrêt] Heure actuelle: {current_time.strftime('%H:%M:%S')}")
+        print("[Arrêt] Le serveur s'arrête car hors de la plage 7h-22h")
+        # Plus de nouvelles connexions; les transferts en cours ont drain_timeout pour finir
+        file_server.close()
+        await server.drain_async()
+
+def start_async_file_server():
+    """Démarre le moteur asyncio du serveur de fichiers"""
+    try:
+        asyncio.run(serve_async())
+    except KeyboardInterrupt:
+        print("\n[Arrêt] Arrêt du serveur...")
+    except Exception as e:
+        print(f"\n[Erreur] {e}")
+    finally:
+        print("Serveur de fichiers arrêté.")
+
+def start_workers(count):
+    """Pré-fork: count processus acceptent sur le même port (SO_REUSEPORT)
+    
+    Les workers sont créés avant tout thread. Le worker 0 sert aussi l'interface
+    web et héberge le bus qui relaie chat, présence, sessions et fichiers.
+    """
+    global server
+    children = []
+    for worker_id in range(count):
+        pid = os.fork()
+        if pid == 0:
+            os.environ['WORKER_ID'] = str(worker_id)
+            server = FileShareServer()
+            if worker_id == 0:
+                threading.Thread(target=start_web_server, daemon=True).start()
+            start_file_server()
+            os._exit(0)
+        children.append(pid)
+    print(f"[Workers] {count} processus démarrés: {' '.join(str(pid) for pid in children)}")
     
-    # Démarrer le serveur web dans un thread séparé
-    web_thread = threading.Thread(target=start_web_server)
-    web_thread.daemon = True
-    web_thread.start()
+    def stop_workers(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop_workers)
     
-    # Démarrer le serveur de fichiers dans le thread principal
-    start_file_server()
+    remaining = set(children)
+    while remaining:
+        try:
+            pid, _ = os.wait()
+            remaining.discard(pid)
+        except KeyboardInterrupt:
+            # Les workers reçoivent aussi le signal et se ferment proprement
+            continue
+        except ChildProcessError:
+            break
+    print("[Workers] Tous les workers sont arrêtés.")
+
+if __name__ == "__main__":
+    workers = int(os.environ.get('WORKERS', 1))
+    if workers > 1:
+        start_workers(workers)
+    else:
+        server = FileShareServer()
+        
+        # Démarrer le serveur web dans un thread séparé
+        web_thread = threading.Thread(target=start_web_server)
+        web_thread.daemon = True
+        web_thread.start()
+        
+        # Démarrer le serveur de fichiers dans le thread principal
+        start_file_server()